@@ -0,0 +1,195 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import typing
+
+import numpy as np
+
+from visualize_convolution import *
+
+X_BOUNDS = (-3, 3) # bounds of the convolutions that are benchmarked
+SAMPLE_WIDTHS = (0.01, 0.005, 0.002)
+QUERY_SIZES = (100, 1000, 10000) # number of points at which each convolution is evaluated
+RESOLUTIONS = (250, 500) # width and height of the canvas of the visualizations
+FRAME_SPACINGS = (1, 5)
+FRAME_COUNTS = (25, 100) # number of frames in each saved animation
+MIN_REPEAT_SECONDS = 0.5 # each timed run repeats a benchmark until it takes at least this long
+NOISE_FLOOR_SECONDS = 1e-4 # slowdowns smaller than this are never flagged as regressions
+NOISE_FLOOR_BYTES = 2**16 # increases in peak memory smaller than this are never flagged
+
+def measure(run: typing.Callable[[], typing.Any], repeats: int) -> tuple[list[float], int]:
+    """Returns the time taken by run in each of the given number of repeats, and
+    the peak memory allocated during a separate run under tracemalloc, so that
+    tracing does not slow down the timed runs. Each timed run makes as many
+    calls as it takes to last at least MIN_REPEAT_SECONDS."""
+    timer = timeit.Timer(run)
+    elapsed = timer.timeit(number=1)
+    number = max(1, math.ceil(MIN_REPEAT_SECONDS / max(elapsed, 1e-6)))
+    repeat_seconds = [total / number for total in timer.repeat(repeat=repeats, number=number)]
+    tracemalloc.start()
+    try:
+        run()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return repeat_seconds, peak_bytes
+
+def result(name: str, parameters: dict, repeat_seconds: list[float], peak_bytes: int, items: int, unit: str) -> dict:
+    """A single benchmark result, timed by its fastest repeat, with the throughput
+    in items per second. The times of all of the repeats are kept as well, so
+    that comparisons can allow for their spread."""
+    seconds = min(repeat_seconds)
+    return {"name": name,
+            "parameters": parameters,
+            "seconds": seconds,
+            "repeat_seconds": repeat_seconds,
+            "throughput": items / seconds,
+            "unit": unit + "/s",
+            "peak_bytes": peak_bytes}
+
+def convolve_benchmarks(repeats: int) -> typing.Iterator[dict]:
+    """Constructing the numerical convolution of two of the example functions, and
+    evaluating it, for each method, sample width and number of query points."""
+    f, g = ConvolutionFunctions.rectangle, ConvolutionFunctions.exponential
+    for method, sample_width in itertools.product(Convolution.methods, SAMPLE_WIDTHS):
+        # closed forms are disabled so that the numerical convolution is measured
+        conv = Convolution(sample_width, X_BOUNDS, method=method, closed_forms=False)
+        parameters = {"method": method, "sample_width": sample_width}
+        repeat_seconds, peak_bytes = measure(lambda: conv.convolve(f, g), repeats)
+        yield result("convolve", parameters, repeat_seconds, peak_bytes, conv.sample_count, "samples")
+        f_conv_g = conv.convolve(f, g)
+        for query_size in QUERY_SIZES:
+            x = np.linspace(*X_BOUNDS, query_size)
+            repeat_seconds, peak_bytes = measure(lambda: f_conv_g(x), repeats)
+            yield result("evaluate", dict(parameters, query_size=query_size),
+                         repeat_seconds, peak_bytes, query_size, "points")
+
+def visualize_benchmarks(repeats: int) -> typing.Iterator[dict]:
+    """Rendering every frame of the visualization of a convolution, for each canvas
+    resolution and frame spacing."""
+    f, g = ConvolutionFunctions.rectangle, ConvolutionFunctions.exponential
+    for resolution, frame_spacing in itertools.product(RESOLUTIONS, FRAME_SPACINGS):
+        def run() -> int:
+            dv = DataVisualizer((-2, 2), (-2, 2), resolution, resolution)
+            return sum(1 for _ in dv.visualize_convolution(f, g, frame_spacing=frame_spacing))
+        frame_count = run()
+        repeat_seconds, peak_bytes = measure(run, repeats)
+        yield result("visualize_convolution", {"resolution": resolution, "frame_spacing": frame_spacing},
+                     repeat_seconds, peak_bytes, frame_count, "frames")
+
+def save_benchmarks(repeats: int, format: str) -> typing.Iterator[dict]:
+    """Saving animations of the visualization of a convolution, for each number of
+    frames, with the frames rendered in advance so that only saving is measured."""
+    dv = DataVisualizer((-2, 2), (-2, 2), 500, 500)
+    animation = dv.visualize_convolution(ConvolutionFunctions.rectangle,
+                                         ConvolutionFunctions.exponential,
+                                         frame_spacing=1)
+    # only the frames that are saved are rendered and held in memory
+    frames = list(itertools.islice(animation, max(FRAME_COUNTS)))
+    with tempfile.TemporaryDirectory() as directory:
+        for frame_count in FRAME_COUNTS:
+            animation = Animation(frames[:frame_count])
+            animation.add_title("Convolution of rectangle and truncated exponential functions")
+            animation.add_legend([("rectangle", (255,0,0)), ("exponential", (0,0,255)), ("convolution", (0,255,0))])
+            filename = os.path.join(directory, f"animation_{frame_count}")
+            repeat_seconds, peak_bytes = measure(lambda: animation.save(filename, format), repeats)
+            yield result("save", {"frame_count": len(animation), "format": format},
+                         repeat_seconds, peak_bytes, len(animation), "frames")
+
+def result_key(benchmark: dict) -> str:
+    """Identifies a benchmark by its name and parameters, to match it with the baseline."""
+    return benchmark["name"] + json.dumps(benchmark["parameters"], sort_keys=True)
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[dict]:
+    """Adds the ratios of the time and peak memory of each result to those of the
+    baseline, and returns the results that are slower or use more memory than
+    the baseline by more than the threshold. As the timings vary from run to run
+    by more than the threshold, a result is only slower if its fastest repeat
+    exceeds the slowest repeat of the baseline by more than the threshold, and
+    differences below the noise floors are not flagged."""
+    baseline = {result_key(benchmark): benchmark for benchmark in baseline}
+    regressions = []
+    for benchmark in results:
+        reference = baseline.get(result_key(benchmark))
+        if reference is None:
+            continue
+        benchmark["time_ratio"] = benchmark["seconds"] / reference["seconds"]
+        benchmark["memory_ratio"] = benchmark["peak_bytes"] / max(reference["peak_bytes"], 1)
+        # baselines saved before the repeats were kept only have the fastest one
+        slowest = max(reference.get("repeat_seconds", [reference["seconds"]]))
+        slower = (benchmark["seconds"] - slowest > NOISE_FLOOR_SECONDS and
+                  benchmark["seconds"] > slowest * (1 + threshold))
+        larger = benchmark["peak_bytes"] - reference["peak_bytes"] > NOISE_FLOOR_BYTES
+        benchmark["regression"] = bool(slower or
+                                       (larger and benchmark["memory_ratio"] > 1 + threshold))
+        if benchmark["regression"]:
+            regressions.append(benchmark)
+    return regressions
+
+def report(benchmark: dict) -> None:
+    """Prints a single result as a line of the results table."""
+    parameters = ", ".join(f"{name}={value}" for name, value in benchmark["parameters"].items())
+    line = (f"{benchmark['name']:<22}{parameters:<50}{benchmark['seconds'] * 1000:>11.2f} ms"
+            f"{benchmark['throughput']:>14.4g} {benchmark['unit']:<10}{benchmark['peak_bytes'] / 2**20:>9.2f} MiB")
+    if "time_ratio" in benchmark:
+        line += f"  x{benchmark['time_ratio']:.2f} time, x{benchmark['memory_ratio']:.2f} memory"
+        if benchmark["regression"]:
+            line += "  REGRESSION"
+    print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the convolutions, the rendering of the "
+                                                 "visualizations and the saving of animations.")
+    parser.add_argument("--only", choices=("convolve", "visualize", "save"), action="append",
+                        help="run only these groups of benchmarks (default: all of them)")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="number of timed runs of each benchmark, of which the fastest is kept (default: 5)")
+    parser.add_argument("--format", choices=Animation.formats, default="gif",
+                        help="file format of the saved animations (default: gif)")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with those in this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative increase in time over the slowest repeat of the baseline, or in "
+                             "peak memory, that is flagged as a regression, for differences above a noise floor "
+                             f"of {NOISE_FLOOR_SECONDS * 1e3:g} ms and {NOISE_FLOOR_BYTES // 2**10} KiB (default: 0.2)")
+    args = parser.parse_args()
+
+    groups = {"convolve": lambda: convolve_benchmarks(args.repeats),
+              "visualize": lambda: visualize_benchmarks(args.repeats),
+              "save": lambda: save_benchmarks(args.repeats, args.format)}
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)["results"]
+
+    results = []
+    for group in args.only or groups:
+        for benchmark in groups[group]():
+            if baseline is not None:
+                compare([benchmark], baseline, args.threshold)
+            report(benchmark)
+            results.append(benchmark)
+
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump({"python": sys.version,
+                       "platform": platform.platform(),
+                       "numpy": np.__version__,
+                       "repeats": args.repeats,
+                       "results": results}, fp, indent=2)
+    if baseline is not None:
+        regressions = [benchmark for benchmark in results if benchmark.get("regression")]
+        print(f"\n{len(regressions)} of {len(results)} benchmarks regressed by more than "
+              f"{args.threshold:.0%} against {args.baseline}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -1,3 +1,9 @@
+import argparse
+import concurrent.futures
+import itertools
+import os
+import typing
+
 import numpy as np
 
 from visualize_convolution import *
@@ -7,67 +13,193 @@ X_BOUNDS = (-3, 3) # should be symmetrical because the exponential has unbounded
 TEST_RANGE = np.linspace(-3, 3, 50) # range of values over which the properties are tested
 
 functions = ConvolutionFunctions()
-conv = Convolution(SAMPLE_WIDTH, X_BOUNDS)
-# Commutativity
-print("Commutativity:")
-mean_commutative = 0
-for f in functions:
-    for g in functions:
-        fg = conv.convolve(f, g)
-        gf = conv.convolve(g, f)
-        acc_commutative = 0
-        for t in TEST_RANGE:
-            acc_commutative += (fg(t) - gf(t)) ** 2
+# closed forms are disabled so that the properties test the numerical convolution
+conv = Convolution(SAMPLE_WIDTH, X_BOUNDS, cache=ConvolutionCache(), closed_forms=False)
+# the built-in functions all have closed forms, so these convolutions are exact
+exact = Convolution(SAMPLE_WIDTH, X_BOUNDS)
+# sampled once so that nested convolutions and sums are computed on arrays
+sampled = {f: conv.sample(f) for f in functions}
+
+def commutativity_error(f: typing.Callable[[float], float],
+                        g: typing.Callable[[float], float]
+                        ) -> float:
+    """Sum of squared differences between f * g and g * f over TEST_RANGE."""
+    fg = conv.convolve(f, g)
+    gf = conv.convolve(g, f)
+    acc_commutative = 0
+    for t in TEST_RANGE:
+        acc_commutative += (fg(t) - gf(t)) ** 2
+    return acc_commutative
+
+def associativity_error(f: typing.Callable[[float], float],
+                        g: typing.Callable[[float], float],
+                        h: typing.Callable[[float], float]
+                        ) -> float:
+    """Sum of squared differences between f*(g*h) and (f*g)*h over TEST_RANGE."""
+    f_gh = conv.convolve(sampled[f], conv.convolve(sampled[g], sampled[h]))
+    fg_h = conv.convolve(conv.convolve(sampled[f], sampled[g]), sampled[h])
+    acc_associative = 0
+    for t in TEST_RANGE:
+        acc_associative += (f_gh(t) - fg_h(t)) ** 2
+    return acc_associative
+
+def distributivity_error(f: typing.Callable[[float], float],
+                         g: typing.Callable[[float], float],
+                         h: typing.Callable[[float], float]
+                         ) -> float:
+    """Sum of squared differences between f*(g+h) and (f*g)+(f*h) over TEST_RANGE."""
+    f_gplush = conv.convolve(sampled[f], sampled[g] + sampled[h])
+    fg_plus_fh = conv.convolve(sampled[f], sampled[g]) + conv.convolve(sampled[f], sampled[h])
+    acc_distributive = 0
+    for t in TEST_RANGE:
+        acc_distributive += (f_gplush(t) - fg_plus_fh(t)) ** 2
+    return acc_distributive
+
+def exact_error(f: typing.Callable[[float], float],
+                g: typing.Callable[[float], float]
+                ) -> float:
+    """Sum of squared differences between the numerical and exact f * g over TEST_RANGE."""
+    return ((conv.convolve(f, g)(TEST_RANGE) - exact.convolve(f, g)(TEST_RANGE)) ** 2).sum()
+
+def run_cases(error_function: typing.Callable[..., float],
+              cases: list[tuple],
+              executor: concurrent.futures.Executor | None = None
+              ) -> list[float]:
+    """Evaluates error_function for each tuple of functions in cases, in the order
+    of cases, spreading the work across the executor if one is given."""
+    if executor is None:
+        return [error_function(*case) for case in cases]
+    return list(executor.map(error_function, *zip(*cases), chunksize=max(1, len(cases) // 64)))
+
+def property_errors(executor: concurrent.futures.Executor | None = None) -> tuple[list, list, list, list]:
+    """Squared error sums for commutativity over every pair of functions, for
+    associativity and distributivity over every triple, and against the exact
+    convolution over every pair, computed case by case."""
+    pairs = list(itertools.product(functions, repeat=2))
+    triples = list(itertools.product(functions, repeat=3))
+    return (run_cases(commutativity_error, pairs, executor),
+            run_cases(associativity_error, triples, executor),
+            run_cases(distributivity_error, triples, executor),
+            run_cases(exact_error, pairs, executor))
+
+def batched_property_errors() -> tuple[list, list, list, list]:
+    """The same squared error sums as property_errors, computed with all of the
+    functions stacked into one array, so that each property takes a few batched
+    convolutions rather than a Python call per case and per point in TEST_RANGE."""
+    samples = conv.sample_all(functions) # indexed [f, x]
+    # as in associativity_error and distributivity_error, convolutions of the samples
+    fg = conv.convolve_sampled(samples[:, np.newaxis], samples[np.newaxis, :]) # indexed [f, g, x]
+    # as in commutativity_error and exact_error, the direct sums at TEST_RANGE with g
+    # itself, as the samples of g would truncate it to the grid
+    shifted = conv.sample_shifted(functions, TEST_RANGE) # indexed [g, t, x]
+    fg_direct = conv.sample_width * np.einsum("fx,gtx->fgt", samples, shifted) # indexed [f, g, t]
+
+    commutative = fg_direct - fg_direct.swapaxes(0, 1)
+    acc_commutative = (commutative ** 2).sum(axis=-1)
+
+    f_gh = conv.convolve_sampled(samples[:, np.newaxis, np.newaxis], fg[np.newaxis])
+    fg_h = conv.convolve_sampled(fg[:, :, np.newaxis], samples[np.newaxis, np.newaxis])
+    associative = conv.evaluate_sampled(f_gh - fg_h, TEST_RANGE)
+    acc_associative = (associative ** 2).sum(axis=-1)
+
+    g_plus_h = samples[:, np.newaxis] + samples[np.newaxis, :]
+    f_gplush = conv.convolve_sampled(samples[:, np.newaxis, np.newaxis], g_plus_h[np.newaxis])
+    fg_plus_fh = fg[:, :, np.newaxis] + fg[:, np.newaxis, :]
+    distributive = conv.evaluate_sampled(f_gplush - fg_plus_fh, TEST_RANGE)
+    acc_distributive = (distributive ** 2).sum(axis=-1)
+
+    exact_fg = np.array([[exact.convolve(f, g)(TEST_RANGE) for g in functions] for f in functions])
+    acc_exact = ((fg_direct - exact_fg) ** 2).sum(axis=-1)
+
+    return (list(acc_commutative.ravel()), list(acc_associative.ravel()),
+            list(acc_distributive.ravel()), list(acc_exact.ravel()))
+
+def report_properties(errors: tuple[list, list, list, list]) -> tuple[float, float, float, float]:
+    """Prints the RMSD for every case of each property, and returns the mean
+    RMSD values for commutativity, associativity, distributivity and the
+    error against the exact convolutions."""
+    pairs = list(itertools.product(functions, repeat=2))
+    triples = list(itertools.product(functions, repeat=3))
+    commutative_errors, associative_errors, distributive_errors, exact_errors = errors
+
+    # Commutativity
+    print("Commutativity:")
+    mean_commutative = 0
+    for (f, g), acc_commutative in zip(pairs, commutative_errors):
         print(f"(f: {f.__name__}; g: {g.__name__}) " +
               f"RMSD between f * g and g * f: {np.sqrt(acc_commutative/len(TEST_RANGE))}")
         mean_commutative += np.sqrt(acc_commutative) / len(TEST_RANGE) / len(functions)**2
 
-# Associativity
-print("\nAssociativity:")
-mean_associative = 0
-for f in functions:
-    for g in functions:
-        for h in functions:
-            acc_associative = 0
-            f_gh = conv.convolve(f, conv.convolve(g, h))
-            fg_h = conv.convolve(conv.convolve(f, g), h)
-            for t in TEST_RANGE:
-                acc_associative += (f_gh(t) - fg_h(t)) ** 2
-            print(f"(f: {f.__name__}; g: {g.__name__}) " +
-                  f"RMSD between f*(g*h) and (f*g)*h: {np.sqrt(acc_associative/len(TEST_RANGE))}")
-            mean_associative += np.sqrt(acc_associative) / len(TEST_RANGE) / len(functions)**3
-
-# Distributivity
-
-print("\nDistributivity:")
-mean_distributive = 0
-for f in functions:
-    for g in functions:
-        for h in functions:
-            acc_distributive = 0
-            f_gplush = conv.convolve(f, lambda t: g(t) + h(t))
-            fg_plus_fh = lambda t: conv.convolve(f, g)(t) + conv.convolve(f, h)(t)
-            for t in TEST_RANGE:
-                acc_distributive += (f_gplush(t) - fg_plus_fh(t)) ** 2
-            print(f"(f: {f.__name__}; g: {g.__name__}) " +
-                  f"RMSD between f*(g+h) and (f*g)+(f*h): {np.sqrt(acc_distributive/len(TEST_RANGE))}")
-            mean_distributive += np.sqrt(acc_distributive) / len(TEST_RANGE) / len(functions)**3
-
-# Identity
-print("\nIdentity:")
-for f in functions:
-    dv = DataVisualizer((-2,2), (-2,2), 500, 500)
-    convolution_sample_width = (dv.x[1] - dv.x[0]) / 2 # this is the same as used internally in the visualization function
-    g = ConvolutionFunctions.delta
-    plot = dv.visualize_convolution(f, g, frame_spacing = 5, g_is_delta = True)
-    plot.add_title(f"Convolution of {f.__name__} with Dirac delta function")
-    plot.add_legend([(f.__name__, (255,0,0)), ("delta", (0, 0, 255)), ("convolution", (0,255,0))])
-    filename = f.__name__ + "_and_delta"
-    plot.save(filename)
-    print(f"Visualization of the existence of the identity for {f.__name__} found in file {filename}.gif.")
-
-# Summary
-print("\n\n")
-print(f"Mean RMSD across all set of functions (commutativity):  {mean_commutative}")
-print(f"Mean RMSD across all set of functions (associativity):  {mean_associative}")
-print(f"Mean RMSD across all set of functions (distributivity): {mean_distributive}")
+    # Associativity
+    print("\nAssociativity:")
+    mean_associative = 0
+    for (f, g, h), acc_associative in zip(triples, associative_errors):
+        print(f"(f: {f.__name__}; g: {g.__name__}) " +
+              f"RMSD between f*(g*h) and (f*g)*h: {np.sqrt(acc_associative/len(TEST_RANGE))}")
+        mean_associative += np.sqrt(acc_associative) / len(TEST_RANGE) / len(functions)**3
+
+    # Distributivity
+    print("\nDistributivity:")
+    mean_distributive = 0
+    for (f, g, h), acc_distributive in zip(triples, distributive_errors):
+        print(f"(f: {f.__name__}; g: {g.__name__}) " +
+              f"RMSD between f*(g+h) and (f*g)+(f*h): {np.sqrt(acc_distributive/len(TEST_RANGE))}")
+        mean_distributive += np.sqrt(acc_distributive) / len(TEST_RANGE) / len(functions)**3
+
+    # Error against the closed forms
+    print("\nExact error:")
+    mean_exact = 0
+    for (f, g), acc_exact in zip(pairs, exact_errors):
+        print(f"(f: {f.__name__}; g: {g.__name__}) " +
+              f"RMSD between f * g and its closed form: {np.sqrt(acc_exact/len(TEST_RANGE))}")
+        mean_exact += np.sqrt(acc_exact) / len(TEST_RANGE) / len(functions)**2
+
+    return mean_commutative, mean_associative, mean_distributive, mean_exact
+
+def main():
+    parser = argparse.ArgumentParser(description="Check properties of convolution for the example functions.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--parallel", action="store_true",
+                      help="spread the property checks and the rendering of the animations across a pool of processes")
+    mode.add_argument("--batched", action="store_true",
+                      help="check the properties for all functions at once with batched array operations")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes used with --parallel, for both the property checks "
+                             "and rendering the identity animations (default: all cores)")
+    args = parser.parse_args()
+
+    if args.batched:
+        errors = batched_property_errors()
+    elif args.parallel:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+            errors = property_errors(executor)
+    else:
+        errors = property_errors()
+    mean_commutative, mean_associative, mean_distributive, mean_exact = report_properties(errors)
+
+    # Identity
+    print("\nIdentity:")
+    for f in functions:
+        dv = DataVisualizer((-2,2), (-2,2), 500, 500)
+        convolution_sample_width = (dv.x[1] - dv.x[0]) / 2 # this is the same as used internally in the visualization function
+        g = ConvolutionFunctions.delta
+        plot = dv.visualize_convolution(f, g, frame_spacing = 5, g_is_delta = True,
+                                        workers=(args.workers or os.cpu_count()) if args.parallel else None)
+        plot.add_title(f"Convolution of {f.__name__} with Dirac delta function")
+        plot.add_legend([(f.__name__, (255,0,0)), ("delta", (0, 0, 255)), ("convolution", (0,255,0))])
+        filename = f.__name__ + "_and_delta"
+        plot.save(filename)
+        print(f"Visualization of the existence of the identity for {f.__name__} found in file {filename}.gif.")
+
+    # Summary
+    print("\n\n")
+    print(f"Mean RMSD across all set of functions (commutativity):  {mean_commutative}")
+    print(f"Mean RMSD across all set of functions (associativity):  {mean_associative}")
+    print(f"Mean RMSD across all set of functions (distributivity): {mean_distributive}")
+    print(f"Mean RMSD across all set of functions (exact error):    {mean_exact}")
+    if not (args.parallel or args.batched):
+        cache_stats = conv.cache.stats()
+        print(f"Convolution cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+
+if __name__ == '__main__':
+    main()
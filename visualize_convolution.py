@@ -13,18 +13,133 @@
 #     distributivity
 #   and demonstrating through animation the multiplicative identity
 
+import argparse
+import atexit
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import inspect
+import itertools
+import json
+import math
+import os
+import sys
+import time
 import typing
 
+from multiprocessing import parent_process
+from multiprocessing import shared_memory
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from PIL import GifImagePlugin
 from PIL import Image
 from PIL import ImageDraw
 
+class Instrumentation:
+    """Counts and timings recorded along the hot paths of the convolutions, the
+    rendering of frames and the saving of animations. Recording is off unless
+    enabled, either by using the instance as a context manager or by setting the
+    environment variable VISUALIZE_CONVOLUTION_INSTRUMENTATION, to 1 to print a
+    summary table when the program exits, or to the name of a .json file to
+    write the results to. Work done inside worker processes is not recorded,
+    apart from the frames that they return."""
+
+    environment_variable = "VISUALIZE_CONVOLUTION_INSTRUMENTATION"
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.counts = collections.Counter()
+        self.timings = collections.defaultdict(lambda: [0, 0.])
+        self._previously_enabled = []
+
+    @classmethod
+    def from_environment(cls) -> typing.Self:
+        """Creates an instance that is enabled if the environment variable is set,
+        reporting its results when the program exits. Worker processes, which
+        inherit the environment, do not report."""
+        destination = os.environ.get(cls.environment_variable, "")
+        instance = cls(enabled=destination not in ("", "0"))
+        if instance.enabled and parent_process() is None:
+            atexit.register(instance._report_at_exit, destination)
+        return instance
+
+    def _report_at_exit(self, destination: str) -> None:
+        """Writes the results to the .json file given by destination, or prints
+        the summary table to stderr otherwise."""
+        if destination.endswith(".json"):
+            with open(destination, "w") as fp:
+                self.dump(fp)
+        else:
+            print(self.summary(), file=sys.stderr)
+
+    def __enter__(self) -> typing.Self:
+        self._previously_enabled.append(self.enabled)
+        self.enabled = True
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.enabled = self._previously_enabled.pop()
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Adds amount to the counter with the given name."""
+        if self.enabled:
+            self.counts[name] += amount
+
+    def timer(self, name: str) -> typing.ContextManager:
+        """A context manager adding the time spent inside it to the timer with the given name."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timed(name)
+
+    @contextlib.contextmanager
+    def _timed(self, name: str) -> typing.Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timing = self.timings[name]
+            timing[0] += 1
+            timing[1] += time.perf_counter() - start
+
+    def reset(self) -> None:
+        """Clears all of the counts and timings."""
+        self.counts.clear()
+        self.timings.clear()
+
+    def as_dict(self) -> dict:
+        """The counts, and the number of calls and total time of each timer."""
+        return {"counts": dict(self.counts),
+                "timings": {name: {"calls": calls, "seconds": seconds}
+                            for name, (calls, seconds) in self.timings.items()}}
+
+    def dump(self, fp: typing.TextIO) -> None:
+        """Writes the counts and timings to fp as JSON."""
+        json.dump(self.as_dict(), fp, indent=2)
+
+    def summary(self) -> str:
+        """The counts and timings as a table."""
+        lines = [f"{'counter':<36}{'count':>16}"]
+        lines += [f"{name:<36}{count:>16}" for name, count in sorted(self.counts.items())]
+        lines += ["", f"{'timer':<36}{'calls':>16}{'seconds':>12}"]
+        lines += [f"{name:<36}{calls:>16}{seconds:>12.3f}" for name, (calls, seconds) in sorted(self.timings.items())]
+        return "\n".join(lines)
+
+instrumentation = Instrumentation.from_environment()
+
 class PlottingImage:
     """A data structure representing an image, along with a number of
        methods for modifying the image such as plotting points and
-       adding text."""
+       adding text.
+
+       The storage determines how the pixels are held in image_array: "float"
+       stores RGB values as float64, "uint8" stores RGB values as bytes, and
+       "palette" stores a single byte per pixel indexing into palette, a mapping
+       from each color used to its index that is shared between copies of the
+       image and is limited to 256 colors."""
+    storages = ("float", "uint8", "palette")
 
     def __init__(self,
                  x_bounds: tuple[float, float],
@@ -32,8 +147,17 @@ class PlottingImage:
                  a_size: int = 100,
                  b_size: int = 100,
                  show_axes: bool = True,
-                 base_image_array: None | np.ndarray = None):
-        self.image_array = np.zeros((a_size, b_size, 3))
+                 base_image_array: None | np.ndarray = None,
+                 storage: str = "uint8",
+                 palette: dict[tuple[int, int, int], int] | None = None):
+        if storage not in self.storages:
+            raise ValueError(f"Unknown image storage {storage!r}, expected one of {self.storages}.")
+        self.storage = storage
+        self.palette = palette if palette is not None else {(0, 0, 0): 0}
+        if storage == "palette":
+            self.image_array = np.zeros((a_size, b_size), dtype=np.uint8)
+        else:
+            self.image_array = np.zeros((a_size, b_size, 3), dtype=float if storage == "float" else np.uint8)
         self.update_base_image(base_image_array)
         self.a_size = a_size
         self.b_size = b_size
@@ -63,6 +187,8 @@ class PlottingImage:
     def clear(self) -> typing.Self:
         """Resets the image to self.base_image_array."""
         self.image_array = self.base_image_array.copy()
+        instrumentation.count("canvas clears")
+        instrumentation.count("canvas bytes copied", self.image_array.nbytes)
         return self
 
     def copy(self) -> typing.Self:
@@ -71,8 +197,14 @@ class PlottingImage:
                              (self.y_min, self.y_max),
                              self.a_size,
                              self.b_size,
-                             base_image_array=self.base_image_array)
+                             show_axes=False,
+                             base_image_array=self.base_image_array,
+                             storage=self.storage,
+                             palette=self.palette)
+        ret.show_axes = self.show_axes
         ret.image_array = self.image_array.copy()
+        instrumentation.count("canvas copies")
+        instrumentation.count("canvas bytes copied", self.image_array.nbytes)
         return ret
 
     def draw_axes(self):
@@ -83,54 +215,177 @@ class PlottingImage:
         # drawing the grid
         for y in np.linspace(y_integer_bounds[0], -1, np.abs(y_integer_bounds[0])):
             a, b = self._coordinate_to_pixel(0., y)
-            self.image_array[a, :] = np.asarray([64, 64, 64])
+            self.image_array[a, :] = self._pixel_value((64, 64, 64))
         for x in np.linspace(x_integer_bounds[0], -1, np.abs(x_integer_bounds[0])):
             a, b = self._coordinate_to_pixel(x, 0.)
-            self.image_array[:, b] = np.asarray([64, 64, 64])
+            self.image_array[:, b] = self._pixel_value((64, 64, 64))
         for y in np.linspace(1, y_integer_bounds[1], np.abs(y_integer_bounds[1])):
             a, b = self._coordinate_to_pixel(0., y)
-            self.image_array[a, :] = np.asarray([64, 64, 64])
+            self.image_array[a, :] = self._pixel_value((64, 64, 64))
         for x in np.linspace(1, x_integer_bounds[1], np.abs(x_integer_bounds[1])):
             a, b = self._coordinate_to_pixel(x, 0.)
-            self.image_array[:, b] = np.asarray([64, 64, 64])
+            self.image_array[:, b] = self._pixel_value((64, 64, 64))
         # drawing the axes
-        self.image_array[y_axis, :] = np.asarray([128, 128, 128])
-        self.image_array[:, x_axis] = np.asarray([128, 128, 128])
+        self.image_array[y_axis, :] = self._pixel_value((128, 128, 128))
+        self.image_array[:, x_axis] = self._pixel_value((128, 128, 128))
+
+    def _pixel_value(self, color: tuple[int, int, int]) -> np.ndarray | int:
+        """The value stored in image_array for a pixel of the given color."""
+        if self.storage != "palette":
+            return np.asarray(color)
+        color = tuple(int(c) for c in color)
+        if color not in self.palette:
+            if len(self.palette) >= 256:
+                raise ValueError("A palette image cannot hold more than 256 colors.")
+            self.palette[color] = len(self.palette)
+        return self.palette[color]
+
+    def _paint(self,
+               a: np.ndarray,
+               b: np.ndarray,
+               color: tuple[int, int, int],
+               overwrite: bool
+               ) -> None:
+        """Sets the pixels at (a, b) to the color, or if not overwriting, to the
+        channelwise maximum of their current color and the color."""
+        if overwrite:
+            self.image_array[a, b] = self._pixel_value(color)
+        elif self.storage != "palette":
+            self.image_array[a, b] = np.maximum(self.image_array[a, b], np.asarray(color))
+        else:
+            # each distinct current color is blended once, then mapped back to the pixels
+            indices, inverse = np.unique(self.image_array[a, b], return_inverse=True)
+            blended = np.maximum(self.palette_array[indices], np.asarray(color))
+            blended_indices = np.array([self._pixel_value(c) for c in blended], dtype=np.uint8)
+            self.image_array[a, b] = blended_indices[inverse]
 
-    def plot(self, x: int | np.ndarray,
-             y: int | np.ndarray,
+    @property
+    def palette_array(self) -> np.ndarray:
+        """The colors of the palette as an array indexed by palette index."""
+        return np.array(list(self.palette), dtype=np.uint8).reshape(-1, 3)
+
+    @property
+    def rgb_array(self) -> np.ndarray:
+        """The image as an array of RGB bytes."""
+        if self.storage == "palette":
+            return self.palette_array[self.image_array]
+        return self.image_array.astype(np.uint8, copy=False)
+
+    def pixel_coordinates(self) -> tuple[np.ndarray, np.ndarray]:
+        """The x coordinate of each column and the y coordinate of each row of pixels,
+        as mapped onto the image by _coordinate_to_pixel."""
+        x = self.x_min + np.arange(self.b_size) * self.x_size / (self.b_size - 1)
+        y = self.y_min + (self.a_size - np.arange(self.a_size)) * self.y_size / (self.a_size - 1)
+        return x, y
+
+    def heatmap(self, values: np.ndarray, color: tuple[int, int, int] = (255, 255, 255)) -> None:
+        """Blends a heatmap onto the image, given a value from 0 to 1 for every pixel,
+        indexed [row, column]. Each pixel is set to the channelwise maximum of its
+        current color and the color scaled by its value. Heatmaps take more colors
+        than a palette can hold, so they cannot be drawn onto palette images."""
+        if self.storage == "palette":
+            raise ValueError("Heatmaps cannot be drawn onto palette images.")
+        layer = np.clip(values, 0, 1)[..., np.newaxis] * np.asarray(color)
+        if self.storage == "uint8":
+            layer = np.rint(layer).astype(np.uint8)
+        np.maximum(self.image_array, layer, out=self.image_array)
+
+    def plot(self, x: float | np.ndarray,
+             y: float | np.ndarray,
              thickness: int = 0,
              color: tuple[int, int, int] = (255, 255, 255),
-             overwrite: bool = True
+             overwrite: bool = True,
+             connect: bool = False
              ) -> None:
-        """Draw a point in Cartesian space onto the image."""
-        a, b = self._coordinate_to_pixel(x, y)
-        if type(y) != 'int' or type(x) != 'int':
-            inside_bounds = (a >= 0) * (a < self.a_size) * (b >= 0) * (b < self.b_size)
-            a = a[inside_bounds]
-            b = b[inside_bounds]
-        try:
-            # prevents complete overwrite of non-black pixels, duplicated below
-            if overwrite:
-                self.image_array[a, b] = np.asarray(color)
-            else:
-                self.image_array[a, b] = np.maximum(self.image_array[a,b], np.asarray(color))
-            if thickness > 0:
-                for pixel in range(thickness):
-                    if overwrite:
-                        self.image_array[a, b + pixel] = np.asarray(color)
-                    else:
-                        self.image_array[a, b + pixel] = np.maximum(np.asarray(color), np.self.image_array[a,b-pixel])
-                    if overwrite:
-                        self.image_array[a, b - pixel] = np.asarray(color)
-                    else:
-                        self.image_array[a, b - pixel] = np.maximum(np.asarray(color), np.self.image_array[a,b-pixel])
-        except IndexError:
-            pass
+        """Draw points in Cartesian space onto the image. With connect, each pair of
+        consecutive points is joined by a line. With a thickness greater than 0,
+        every pixel drawn is widened into a square reaching thickness - 1 pixels
+        in each direction. Points that are not finite are skipped."""
+        x, y = np.broadcast_arrays(np.atleast_1d(np.asarray(x, dtype=float)),
+                                   np.atleast_1d(np.asarray(y, dtype=float)))
+        finite = np.isfinite(x) & np.isfinite(y)
+        x = np.where(finite, x, self.x_min)
+        y = np.where(finite, y, self.y_min)
+        # the same mapping as _coordinate_to_pixel, before rounding, bounded so that the
+        # arithmetic on very distant points stays finite
+        a_exact = np.clip(self.a_size - (self.a_size - 1) * (y - self.y_min) / self.y_size, -1e9, 1e9)
+        b_exact = np.clip((self.b_size - 1) * (x - self.x_min) / self.x_size, -1e9, 1e9)
+        a = (self.a_size - np.trunc(self.a_size - a_exact)).astype(int)
+        b = np.trunc(b_exact).astype(int)
+        margin = thickness + 1
+        if connect and len(a) > 1:
+            # segments are cut to the image and its margin, keeping their slopes
+            segments = np.flatnonzero(finite[:-1] & finite[1:])
+            a_start, b_start, a_end, b_end, inside = self._clip_segments(
+                a_exact[segments], b_exact[segments], a_exact[segments + 1], b_exact[segments + 1],
+                (-margin, self.a_size + margin), (-margin, self.b_size + margin))
+            line_a, line_b = self._line_pixels(
+                (self.a_size - np.trunc(self.a_size - a_start[inside])).astype(int), np.trunc(b_start[inside]).astype(int),
+                (self.a_size - np.trunc(self.a_size - a_end[inside])).astype(int), np.trunc(b_end[inside]).astype(int))
+            a = np.concatenate((a[finite], line_a))
+            b = np.concatenate((b[finite], line_b))
+        else:
+            a = a[finite]
+            b = b[finite]
+        if thickness > 1:
+            a_offsets, b_offsets = np.meshgrid(np.arange(1 - thickness, thickness), np.arange(1 - thickness, thickness))
+            a = (a[:, np.newaxis] + a_offsets.ravel()).ravel()
+            b = (b[:, np.newaxis] + b_offsets.ravel()).ravel()
+        inside_bounds = (a >= 0) & (a < self.a_size) & (b >= 0) & (b < self.b_size)
+        # overwrite=False prevents complete overwrite of non-black pixels
+        self._paint(a[inside_bounds], b[inside_bounds], color, overwrite)
+
+    @staticmethod
+    def _clip_segments(a_start: np.ndarray,
+                       b_start: np.ndarray,
+                       a_end: np.ndarray,
+                       b_end: np.ndarray,
+                       a_bounds: tuple[float, float],
+                       b_bounds: tuple[float, float]
+                       ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Cuts each line segment from (a_start, b_start) to (a_end, b_end) to the part
+        inside the rectangle given by a_bounds and b_bounds, with the Liang-Barsky
+        algorithm. Returns the ends of the cut segments, along with whether each
+        segment crosses the rectangle at all."""
+        a_step = a_end - a_start
+        b_step = b_end - b_start
+        enter = np.zeros(len(a_start))
+        leave = np.ones(len(a_start))
+        inside = np.ones(len(a_start), dtype=bool)
+        # for each edge, the rate at which the segment moves towards the outside of the
+        # edge, and the distance from the start of the segment to the edge
+        for rate, distance in ((-a_step, a_start - a_bounds[0]), (a_step, a_bounds[1] - a_start),
+                               (-b_step, b_start - b_bounds[0]), (b_step, b_bounds[1] - b_start)):
+            inside &= (rate != 0) | (distance >= 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossing = distance / rate
+            enter = np.where(rate < 0, np.maximum(enter, crossing), enter)
+            leave = np.where(rate > 0, np.minimum(leave, crossing), leave)
+        inside &= enter <= leave
+        return (a_start + enter * a_step, b_start + enter * b_step,
+                a_start + leave * a_step, b_start + leave * b_step, inside)
+
+    @staticmethod
+    def _line_pixels(a_start: np.ndarray,
+                     b_start: np.ndarray,
+                     a_end: np.ndarray,
+                     b_end: np.ndarray
+                     ) -> tuple[np.ndarray, np.ndarray]:
+        """The pixels along each of the line segments from (a_start, b_start) to
+        (a_end, b_end), including both ends, computed for all segments at once
+        by stepping one pixel at a time along the longer axis of each segment."""
+        steps = np.maximum(np.abs(a_end - a_start), np.abs(b_end - b_start))
+        counts = steps + 1
+        segment = np.repeat(np.arange(len(steps)), counts)
+        position = np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)
+        fraction = position / np.maximum(steps, 1)[segment]
+        a = np.rint(a_start[segment] + (a_end - a_start)[segment] * fraction).astype(int)
+        b = np.rint(b_start[segment] + (b_end - b_start)[segment] * fraction).astype(int)
+        return a, b
 
     def show(self) -> None:
         """Shows the image using matplotlib for quick reference."""
-        plt.imshow(self.image_array)
+        plt.imshow(self.rgb_array)
         plt.show()
 
     def update_base_image(self, image_array: None | np.ndarray = None):
@@ -139,41 +394,254 @@ class PlottingImage:
         clear() is called."""
         if image_array is None:
             self.base_image_array = self.image_array.copy()
+            instrumentation.count("canvas base copies")
+            instrumentation.count("canvas bytes copied", self.base_image_array.nbytes)
         else:
             self.base_image_array = image_array
 
+class TextOverlay:
+    """Text that is drawn over every frame of an animation. The text is rendered
+    once, by draw_text, into a coverage mask and a color layer, which are then
+    blended onto each frame with numpy. Numbers, such as the frame number, are
+    composed from a cache of pre-rendered digits. Palette frames are given the
+    color of the text wherever the text covers at least half of a pixel."""
+
+    def __init__(self, size: tuple[int, int], draw_text: typing.Callable[[ImageDraw.ImageDraw, tuple | int | None], None]):
+        # drawing onto black, the color layer holds the text colors premultiplied by coverage
+        color_image = Image.new('RGB', size)
+        mask_image = Image.new('L', size)
+        draw_text(ImageDraw.Draw(color_image), None)
+        draw_text(ImageDraw.Draw(mask_image), 255)
+        coverage = np.asarray(mask_image)
+        self.rows, self.cols = np.nonzero(coverage)
+        self.alpha = coverage[self.rows, self.cols, np.newaxis] / 255
+        self.color = np.asarray(color_image)[self.rows, self.cols].astype(float)
+        self.font = ImageDraw.Draw(mask_image).getfont()
+        self.digits = {}
+        self._palette_cache = (None, None)
+
+    def _digit(self, digit: str) -> np.ndarray:
+        """The coverage mask of a digit drawn with its origin at the top left corner."""
+        if digit not in self.digits:
+            _, _, right, bottom = self.font.getbbox(digit)
+            glyph = Image.new('L', (max(int(np.ceil(right)), 1), max(int(np.ceil(bottom)), 1)))
+            ImageDraw.Draw(glyph).text((0, 0), digit, fill=255, font=self.font)
+            self.digits[digit] = np.asarray(glyph) / 255
+        return self.digits[digit]
+
+    def _number_masks(self, number: int, xy: tuple[int, int]) -> typing.Iterator[tuple[tuple[slice, slice], np.ndarray]]:
+        """The regions of the image covered by each digit of the number, along with
+        the coverage of the digit in that region."""
+        text = str(number)
+        for i, digit in enumerate(text):
+            mask = self._digit(digit)
+            x = xy[0] + int(round(self.font.getlength(text[:i])))
+            y = xy[1]
+            yield (slice(y, y + mask.shape[0]), slice(x, x + mask.shape[1])), mask
+
+    def apply(self, image_array: np.ndarray, number: int, number_xy: tuple[int, int],
+              number_color: tuple[int, int, int]) -> np.ndarray:
+        """Returns a copy of an RGB byte image with the text and the number blended onto it."""
+        out = image_array.copy()
+        blended = out[self.rows, self.cols] * (1 - self.alpha) + self.color
+        out[self.rows, self.cols] = np.rint(blended).astype(np.uint8)
+        for region, mask in self._number_masks(number, number_xy):
+            target = out[region]
+            mask = mask[:target.shape[0], :target.shape[1], np.newaxis]
+            out[region] = np.rint(target * (1 - mask) + np.asarray(number_color) * mask).astype(np.uint8)
+        return out
+
+    def apply_indices(self, image: PlottingImage, number: int, number_xy: tuple[int, int],
+                      number_color: tuple[int, int, int]) -> np.ndarray:
+        """Returns a copy of the palette indices of an image with the text and the
+        number set in their colors, adding those colors to the palette of the image."""
+        palette, indices = self._palette_cache
+        if palette is not image.palette:
+            covered = self.alpha[:, 0] >= 0.5
+            colors = np.rint(self.color[covered] / self.alpha[covered]).astype(int)
+            indices = (covered, np.array([image._pixel_value(color) for color in colors], dtype=np.uint8))
+            self._palette_cache = (image.palette, indices)
+        covered, covered_indices = indices
+        out = image.image_array.copy()
+        out[self.rows[covered], self.cols[covered]] = covered_indices
+        number_index = image._pixel_value(number_color)
+        for region, mask in self._number_masks(number, number_xy):
+            target = out[region]
+            target[mask[:target.shape[0], :target.shape[1]] >= 0.5] = number_index
+        return out
+
 class Animation:
-    """A collection of PlottingImage objects that represents an animation."""
+    """A collection of PlottingImage objects that represents an animation.
+    The frames are either given as a list, or produced lazily by frame_source,
+    a function returning an iterator over the frames, which is called each time
+    the animation is iterated over so that frames are only rendered as they are
+    consumed."""
+
+    formats = ("gif", "webp", "apng")
+    extensions = {"gif": ".gif", "webp": ".webp", "apng": ".png"}
+    image_description_tag = 0x010E # EXIF tag holding the comment of WebP and APNG files
 
-    def __init__(self, image_list: typing.List[PlottingImage]):
-        self.image_list = image_list
+    def __init__(self,
+                 image_list: typing.List[PlottingImage] | None = None,
+                 frame_source: typing.Callable[[], typing.Iterator[PlottingImage]] | None = None,
+                 frame_count: int | None = None):
+        self._image_list = image_list
+        self.frame_source = frame_source
+        self.frame_count = len(image_list) if image_list is not None else frame_count
         self.title = ""
         self.legend = []
 
+    @property
+    def image_list(self) -> typing.List[PlottingImage]:
+        """The frames of the animation as a list, rendering all of them if they
+        are produced lazily."""
+        if self._image_list is None:
+            self._image_list = list(self.frame_source())
+        return self._image_list
+
+    def __iter__(self) -> typing.Iterator[PlottingImage]:
+        if self._image_list is not None:
+            return iter(self._image_list)
+        return self.frame_source()
+
+    def __len__(self):
+        if self.frame_count is None:
+            return len(self.image_list)
+        return self.frame_count
+
     def copy(self) -> typing.Self:
         """Returns a copy of this object that can be passed by reference safely."""
-        return Animation(self.image_list.copy())
+        if self._image_list is None:
+            return Animation(frame_source=self.frame_source, frame_count=self.frame_count)
+        return Animation(self._image_list.copy())
 
-    def _draw_legend(self, drawing):
-        """Draw the plot legend onto the images in the animation."""
+    def _draw_legend(self, drawing, fill=None):
+        """Draw the plot legend onto the images in the animation, in the colors of
+        the legend unless a fill is given."""
         for i, item in enumerate(self.legend):
-            drawing.text((400, 60 + 10 * i), item[0], fill=item[1])
-
-    def save(self, filename: str) -> None:
-        """Save the animation to a .gif file."""
-        images = []
-        for frame, image in enumerate(self.image_list):
-            # reordering dimensions to format taken by PIL.Image
-            image_array = image.image_array.astype('uint8')
-            images.append(Image.fromarray(image_array, mode='RGB'))
-            drawing = ImageDraw.Draw(images[-1])
-            drawing.text((10,10), f"{frame}", fill=(255, 255, 255))
-            drawing.text((30, 30), self.title, fill=(255, 255, 255))
-            # axis labels
-            drawing.text((480, 260), "x", fill = (255, 255, 255))
-            drawing.text((260, 480), "y", fill = (255, 255, 255))
-            self._draw_legend(drawing)
-        images[0].save(filename + '.gif', append_images=images[1:], save_all=True, duration=1)
+            drawing.text((400, 60 + 10 * i), item[0], fill=item[1] if fill is None else fill)
+
+    def _draw_text(self, drawing, fill=None):
+        """Draw the title, axis labels and legend, which are the same on every frame."""
+        white = (255, 255, 255) if fill is None else fill
+        drawing.text((30, 30), self.title, fill=white)
+        # axis labels
+        drawing.text((480, 260), "x", fill=white)
+        drawing.text((260, 480), "y", fill=white)
+        self._draw_legend(drawing, fill)
+
+    def _render_frame(self, frame: int, image: PlottingImage, overlay: TextOverlay) -> Image.Image:
+        """Converts a frame of the animation to a PIL image, with the frame number,
+        title, axis labels and legend blended onto it from the overlay. Frames
+        stored with a palette are converted to palette images."""
+        if image.storage == "palette":
+            rendered = Image.fromarray(overlay.apply_indices(image, frame, (10, 10), (255, 255, 255)), mode='P')
+            rendered.putpalette(image.palette_array.ravel())
+        else:
+            rendered = Image.fromarray(overlay.apply(image.rgb_array, frame, (10, 10), (255, 255, 255)), mode='RGB')
+        return rendered
+
+    def _rendered_frames(self) -> typing.Iterator[Image.Image]:
+        """The frames of the animation rendered to PIL images one at a time, with
+        the text overlay built from the size of the first frame."""
+        overlay = None
+        images = iter(self)
+        for frame in itertools.count():
+            with instrumentation.timer("render frames"):
+                image = next(images, None)
+            if image is None:
+                return
+            with instrumentation.timer("draw text"):
+                if overlay is None:
+                    overlay = TextOverlay((image.b_size, image.a_size), self._draw_text)
+                rendered = self._render_frame(frame, image, overlay)
+            instrumentation.count("frames saved")
+            yield rendered
+
+    def save(self, filename: str, format: str = "gif", comment: str | None = None) -> None:
+        """Save the animation to a file, with the extension given by the format.
+        GIF frames are streamed to the file, so only one frame is held in memory
+        at a time, and after the first frame only the bounding box of the pixels
+        that changed is written, with the unchanged pixels inside it transparent.
+        The WebP and APNG encoders of Pillow, which take every frame at once and
+        work out the changed regions themselves, are used for the other formats.
+        A comment is stored in the comment extension of a GIF, and as the image
+        description in the EXIF data of the other formats."""
+        if format not in self.formats:
+            raise ValueError(f"Unknown animation format {format!r}, expected one of {self.formats}.")
+        frames = self._rendered_frames()
+        if format == "gif":
+            with open(filename + self.extensions[format], 'wb') as fp:
+                frame_count = self._write_gif(fp, frames, comment)
+            if not frame_count:
+                raise ValueError("Cannot save an animation without any frames.")
+            return
+        first = next(frames, None)
+        if first is None:
+            raise ValueError("Cannot save an animation without any frames.")
+        # palette frames may add colors as they go, so they are encoded as RGB
+        first, *rest = [rendered.convert('RGB') for rendered in itertools.chain([first], frames)]
+        exif = Image.Exif()
+        if comment is not None:
+            exif[Animation.image_description_tag] = comment
+        with instrumentation.timer("encode frames"):
+            if format == "webp":
+                first.save(filename + self.extensions[format], save_all=True, append_images=rest,
+                           duration=1, loop=0, lossless=True, exif=exif)
+            else:
+                first.save(filename + self.extensions[format], save_all=True, append_images=rest,
+                           duration=1, loop=0, default_image=False, exif=exif)
+
+    @staticmethod
+    def _write_gif(fp: typing.BinaryIO, frames: typing.Iterator[Image.Image], comment: str | None = None) -> int:
+        """Writes the frames to fp as a GIF, each frame after the first as the
+        changed region of the image drawn over the previous frame, and returns
+        the number of frames written. Frames that are not palette images are
+        quantized to an adaptive palette, leaving an index free for transparency."""
+        previous = None
+        frame_count = 0
+        for rendered in frames:
+            with instrumentation.timer("encode frames"):
+                # palette frames are compared by index, as the palette of a frame only ever grows
+                current = np.asarray(rendered)
+                if previous is None:
+                    if rendered.mode != 'P':
+                        rendered = rendered.convert('P', palette=Image.Palette.ADAPTIVE)
+                    # the palette of the first frame is the global palette
+                    info = {"duration": 1} if comment is None else {"duration": 1, "comment": comment}
+                    header, _ = GifImagePlugin.getheader(rendered, info=info)
+                    fp.writelines(header)
+                    fp.writelines(GifImagePlugin.getdata(rendered, duration=1, disposal=1))
+                else:
+                    changed = current != previous
+                    if changed.ndim == 3:
+                        changed = changed.any(axis=-1)
+                    rows = np.flatnonzero(changed.any(axis=1))
+                    cols = np.flatnonzero(changed.any(axis=0))
+                    if not len(rows):
+                        # an unchanged frame is written as a single transparent pixel
+                        rows = cols = np.zeros(1, dtype=int)
+                    box = (cols[0], rows[0], cols[-1] + 1, rows[-1] + 1)
+                    region = rendered.crop(box)
+                    if region.mode != 'P':
+                        region = region.convert('P', palette=Image.Palette.ADAPTIVE, colors=255)
+                    palette = region.getpalette()
+                    indices = np.array(region)
+                    transparency = len(palette) // 3
+                    if transparency < 256:
+                        indices[~changed[box[1]:box[3], box[0]:box[2]]] = transparency
+                        palette = palette + [0, 0, 0]
+                    else:
+                        transparency = None
+                    delta = Image.fromarray(indices, mode='P')
+                    delta.putpalette(palette)
+                    fp.writelines(GifImagePlugin.getdata(delta, offset=box[:2], duration=1, disposal=1,
+                                                         transparency=transparency, include_color_table=True))
+                previous = current
+            frame_count += 1
+        if frame_count:
+            fp.write(b";")
+        return frame_count
 
     def add_title(self, title: str):
         """Add a title to the images in the animation."""
@@ -192,9 +660,10 @@ class DataVisualizer:
                  x_bounds: tuple[float, float],
                  y_bounds: tuple[float, float],
                  x_resolution: float,
-                 y_resolution: float
+                 y_resolution: float,
+                 storage: str = "uint8"
                  ):
-        self.canvas = PlottingImage(x_bounds, y_bounds, x_resolution, y_resolution)
+        self.canvas = PlottingImage(x_bounds, y_bounds, x_resolution, y_resolution, storage=storage)
         self.line_thickness = 2
 
         self.x_min = x_bounds[0]
@@ -220,10 +689,18 @@ class DataVisualizer:
                          color: tuple[int, int, int] = (255, 255, 255)
                          ) -> PlottingImage:
         """Plots a function at the values in x onto the canvas."""
-        y = function(x)
-        self.canvas.plot(x, y, self.line_thickness, color=color)
+        self._plot_function(function, x, color)
         return self.canvas.copy()
 
+    def _plot_function(self,
+                       function: typing.Callable[[float], float],
+                       x: np.ndarray,
+                       color: tuple[int, int, int]
+                       ) -> None:
+        """Plots a function at the values in x onto the canvas as a connected line,
+        without copying it."""
+        self.canvas.plot(x, function(x), self.line_thickness, color=color, connect=True)
+
     def function_animation(self,
                            function: typing.Callable[[float], float],
                            x: np.ndarray,
@@ -231,14 +708,21 @@ class DataVisualizer:
                            color: tuple[int, int, int] = (255, 255, 255)
                            ) -> Animation:
         """Creates an animation plotting a function from the lower x bound
-        of the canvas to the upper x bound."""
-        animation_list = []
-        for frame in range(len(x)):
-            plot = self.function_plotter(function, x[frame], color=color)
-            # add every (frame_spacing)-th image to animation
-            if not (frame % frame_spacing):
-                animation_list.append(plot)
-        self.animation = Animation(animation_list)
+        of the canvas to the upper x bound. The frames are rendered lazily,
+        starting from the current state of the canvas."""
+        start = self.canvas.image_array.copy()
+        def frames() -> typing.Iterator[PlottingImage]:
+            self.canvas.image_array = start.copy()
+            for frame in range(len(x)):
+                # the previous point is included so that the line stays connected
+                self._plot_function(function, x[max(frame - 1, 0):frame + 1], color)
+                # add every (frame_spacing)-th image to animation
+                if not (frame % frame_spacing):
+                    instrumentation.count("frames rendered")
+                    yield self.canvas.copy()
+                else:
+                    instrumentation.count("frames dropped")
+        self.animation = Animation(frame_source=frames, frame_count=len(range(0, len(x), frame_spacing)))
         return self.animation.copy()
 
     def lock_canvas(self) -> PlottingImage:
@@ -257,34 +741,67 @@ class DataVisualizer:
                           ) -> PlottingImage:
         """Plots a function on the range of x values, for a given parameter
         of the function t."""
-        y = function(x, t)
-        if overlap_function is not None:
-            f_x = overlap_function(x)
-            overlap = x[y * f_x != 0]
-            for x_val in overlap:
-                Y = np.array([y for y in self.y if y > 0 and y < min(overlap_function(x_val), function(x_val, t))])
-                X = np.repeat(x_val, len(Y))
-                self.area_plotter(X, Y)
-        self.canvas.plot(x, y, self.line_thickness, color=color)
+        self._plot_parameter_function(function, x, t, color, overlap_function)
         return self.canvas.copy()
 
+    def _plot_parameter_function(self,
+                                 function: typing.Callable[[float, float], float],
+                                 x: np.ndarray,
+                                 t: float,
+                                 color: tuple[int, int, int],
+                                 overlap_function: typing.Callable[[float], float] | None
+                                 ) -> None:
+        """Plots a function for a given parameter t onto the canvas, without copying it."""
+        f_x = None if overlap_function is None else overlap_function(x)
+        self._plot_parameter_values(x, function(x, t), color, f_x)
+
+    def _plot_parameter_values(self,
+                               x: np.ndarray,
+                               y: np.ndarray,
+                               color: tuple[int, int, int],
+                               f_x: np.ndarray | None
+                               ) -> None:
+        """Plots the values y at x onto the canvas, shading the area where they
+        overlap with the values f_x of the overlap function if those are given."""
+        if f_x is not None:
+            overlapping = y * f_x != 0
+            # one row per overlapping x value, one column per y value of the canvas
+            upper = np.minimum(f_x[overlapping], y[overlapping])[:, np.newaxis]
+            area = (self.y > 0) & (self.y < upper)
+            X = np.broadcast_to(x[overlapping][:, np.newaxis], area.shape)[area]
+            Y = np.broadcast_to(self.y, area.shape)[area]
+            self.area_plotter(X, Y)
+        self.canvas.plot(x, y, self.line_thickness, color=color, connect=True)
+
     def parameter_animation(self,
                             function: typing.Callable[[float, float], float],
                             x: np.ndarray,
                             t: np.ndarray,
                             frame_spacing: int = 1,
-                            color: tuple[int, int, int] = (255, 255, 255)
+                            color: tuple[int, int, int] = (255, 255, 255),
+                            workers: int | None = None
                             ) -> Animation:
         """Plots an animation of a family of functions of x onto the canvas,
-        varying the parameter t of the family for each frame."""
-        animation_list = []
-        for frame in range(len(t)):
-            # add every (frame_spacing)-th image to animation
-            if not (frame % frame_spacing):
+        varying the parameter t of the family for each frame. The frames are
+        rendered lazily, and across a pool of processes if workers is given."""
+        if workers is not None:
+            kept = t[::frame_spacing]
+            renderer = ParallelFrameRenderer(self, self.canvas.base_image_array, x,
+                                             workers=workers, parameter_color=color)
+            def parallel_frames() -> typing.Iterator[PlottingImage]:
+                instrumentation.count("frames dropped", len(t) - len(kept))
+                return renderer.frames([function(x, t_value) for t_value in kept])
+            self.animation = Animation(frame_source=parallel_frames, frame_count=len(kept))
+            return self.animation.copy()
+        def frames() -> typing.Iterator[PlottingImage]:
+            # only every (frame_spacing)-th image is added to the animation
+            instrumentation.count("frames dropped", len(t) - len(range(0, len(t), frame_spacing)))
+            for frame in range(0, len(t), frame_spacing):
                 self.canvas.clear()
-                plot = self.parameter_plotter(function, x, t[frame], color=color)
-                animation_list.append(plot)
-        self.animation = Animation(animation_list)
+                self._plot_parameter_function(function, x, t[frame], color, None)
+                instrumentation.count("frames rendered")
+                yield self.canvas.copy()
+        self.animation = Animation(frame_source=frames, frame_count=len(range(0, len(t), frame_spacing)))
         return self.animation.copy()
 
     def function_and_parameter_animation(self,
@@ -295,34 +812,64 @@ class DataVisualizer:
                                          frame_spacing: int = 1,
                                          function_color: tuple[int, int, int] = (255, 255, 255),
                                          parameter_function_color: tuple[int, int, int] = (255, 255, 255),
-                                         overlap_function: typing.Callable[[float], float] | None = None
+                                         overlap_function: typing.Callable[[float], float] | None = None,
+                                         workers: int | None = None
                                          ) -> Animation:
         """Performs the function and parameter plotter animations
-        simultaneously to the canvas."""
-        animation_list = []
-        for frame in range(len(t)):
-            function_plot = self.function_plotter(function, x[frame], color=function_color)
-            self.lock_canvas()
-            # add every (frame_spacing)-th image to animation
-            if not (frame % frame_spacing):
-                parameter_plot = self.parameter_plotter(parameter_function,
-                                                        x,
-                                                        t[frame],
-                                                        color=parameter_function_color,
-                                                        overlap_function=overlap_function)
-                animation_list.append(parameter_plot)
-                self.canvas.clear()
-        self.animation = Animation(animation_list)
+        simultaneously to the canvas. The frames are rendered lazily, starting
+        from the current state of the canvas, and for frames that are skipped
+        only the function is plotted. If workers is given, the frames are
+        rendered across a pool of processes, with the plotted function computed
+        in advance, and the canvas itself is left unchanged."""
+        if workers is not None:
+            frame_indices = range(0, len(t), frame_spacing)
+            trace_x = np.asarray(x[:len(t)])
+            renderer = ParallelFrameRenderer(self,
+                                             self.canvas.image_array,
+                                             x,
+                                             workers=workers,
+                                             parameter_color=parameter_function_color,
+                                             trace=(trace_x, function(trace_x), function_color),
+                                             overlap=None if overlap_function is None else overlap_function(x))
+            def parallel_frames() -> typing.Iterator[PlottingImage]:
+                instrumentation.count("frames dropped", len(t) - len(frame_indices))
+                return renderer.frames((parameter_function(x, t[frame]) for frame in frame_indices),
+                                       trace_counts=(frame + 1 for frame in frame_indices))
+            self.animation = Animation(frame_source=parallel_frames, frame_count=len(frame_indices))
+            return self.animation.copy()
+        start = self.canvas.image_array.copy()
+        def frames() -> typing.Iterator[PlottingImage]:
+            self.canvas.image_array = start.copy()
+            for frame in range(len(t)):
+                # the previous point is included so that the line stays connected
+                self._plot_function(function, x[max(frame - 1, 0):frame + 1], function_color)
+                # add every (frame_spacing)-th image to animation
+                if not (frame % frame_spacing):
+                    self.canvas.update_base_image()
+                    self._plot_parameter_function(parameter_function,
+                                                  x,
+                                                  t[frame],
+                                                  parameter_function_color,
+                                                  overlap_function)
+                    instrumentation.count("frames rendered")
+                    yield self.canvas.copy()
+                    self.canvas.clear()
+                else:
+                    instrumentation.count("frames dropped")
+            self.canvas.update_base_image()
+        self.animation = Animation(frame_source=frames, frame_count=len(range(0, len(t), frame_spacing)))
         return self.animation.copy()
 
     def visualize_convolution(self,
                               f: typing.Callable[[float, float], float],
                               g: typing.Callable[[float, float], float],
                               frame_spacing: int = 1,
-                              g_is_delta = False
+                              g_is_delta = False,
+                              workers: int | None = None
                               ) -> Animation:
         """Creates an animation to visualize the convolution of the
-        functions f and g."""
+        functions f and g. If workers is given, the frames are rendered
+        across that many processes."""
         self.function_plotter(f, self.x, color = (255, 0, 0))
         self.lock_canvas()
         # a convolution sampling two x values for every pixel
@@ -342,44 +889,919 @@ class DataVisualizer:
                                                      frame_spacing=frame_spacing,
                                                      function_color=(0,255,0),
                                                      parameter_function_color=(0,0,255),
-                                                     overlap_function=f
+                                                     overlap_function=f,
+                                                     workers=workers
                                                      )
 
+    def visualize_convolution_2d(self,
+                                 f: typing.Callable[[float, float], float],
+                                 g: typing.Callable[[float, float], float],
+                                 frame_spacing: int = 1,
+                                 separable: bool = True
+                                 ) -> Animation:
+        """Creates a heatmap animation to visualize the convolution of the functions
+        f and g of x and y. f is drawn in red, and g, flipped and centered at the
+        point (t, 0), in blue, so that their overlap shows as magenta while t moves
+        along the x axis from the lower x bound to the upper x bound. Behind it,
+        the convolution is revealed in green up to t. Each layer is scaled by its
+        largest value. The frames are rendered lazily."""
+        x, y = self.canvas.pixel_coordinates()
+        x_grid, y_grid = x[np.newaxis, :], y[:, np.newaxis]
+        pixel_width = min(x[1] - x[0], y[0] - y[1])
+        convolution = Convolution2D(pixel_width,
+                                    (self.canvas.x_min, self.canvas.x_max),
+                                    (self.canvas.y_min, self.canvas.y_max),
+                                    separable=separable)
+        f_conv_g = convolution.convolve(f, g)
+
+        def normalized(values: np.ndarray) -> np.ndarray:
+            values = np.broadcast_to(values, (len(y), len(x)))
+            largest = np.abs(values).max()
+            return values / largest if largest else values
+
+        self.canvas.heatmap(normalized(f(x_grid, y_grid)), (255, 0, 0))
+        self.lock_canvas()
+        convolution_values = normalized(f_conv_g(x_grid, y_grid))
+        def frames() -> typing.Iterator[PlottingImage]:
+            instrumentation.count("frames dropped", len(x) - len(range(0, len(x), frame_spacing)))
+            for frame in range(0, len(x), frame_spacing):
+                self.canvas.clear()
+                self.canvas.heatmap(normalized(g(x[frame] - x_grid, -y_grid)), (0, 0, 255))
+                revealed = np.where(x_grid <= x[frame], convolution_values, 0.)
+                self.canvas.heatmap(revealed, (0, 255, 0))
+                instrumentation.count("frames rendered")
+                yield self.canvas.copy()
+        self.animation = Animation(frame_source=frames, frame_count=len(range(0, len(x), frame_spacing)))
+        return self.animation.copy()
+
+class ParallelFrameRenderer:
+    """Renders frames of the animations of a DataVisualizer across a pool of
+    processes. The locked base image of the canvas is placed in shared memory,
+    and all the functions involved are evaluated in advance, so that the
+    workers only receive arrays of values to plot. Each frame is the base image,
+    with the first trace_count points of the trace plotted onto it, followed by
+    the values of the parameter function for the frame, and the shaded overlap
+    with the overlap values if those are given."""
+
+    # state of each worker process, set up by _initialize_worker
+    _worker_visualizer = None
+    _worker_memory = None
+    _worker_arguments = None
+
+    def __init__(self,
+                 visualizer: "DataVisualizer",
+                 base_image_array: np.ndarray,
+                 x: np.ndarray,
+                 workers: int,
+                 parameter_color: tuple[int, int, int],
+                 trace: tuple[np.ndarray, np.ndarray, tuple[int, int, int]] | None = None,
+                 overlap: np.ndarray | None = None):
+        canvas = visualizer.canvas
+        if canvas.storage == "palette":
+            raise ValueError("Parallel rendering requires an image storage of \"float\" or \"uint8\".")
+        self.visualizer = visualizer
+        self.workers = workers
+        self.base_image_array = base_image_array.copy()
+        self.geometry = ((canvas.x_min, canvas.x_max), (canvas.y_min, canvas.y_max),
+                         canvas.a_size, canvas.b_size, canvas.storage)
+        self.arguments = (np.asarray(x), parameter_color, trace, overlap, visualizer.line_thickness)
+
+    def frames(self,
+               parameter_values: typing.Iterable[np.ndarray],
+               trace_counts: typing.Iterable[int] | None = None
+               ) -> typing.Iterator[PlottingImage]:
+        """Renders one frame for each array of values of the parameter function,
+        yielding them in order. At most two frames per worker are in flight at
+        a time, so frames that have not been consumed do not accumulate."""
+        if trace_counts is None:
+            trace_counts = itertools.repeat(0)
+        memory = shared_memory.SharedMemory(create=True, size=self.base_image_array.nbytes)
+        try:
+            shared_base = np.ndarray(self.base_image_array.shape, self.base_image_array.dtype, buffer=memory.buf)
+            shared_base[...] = self.base_image_array
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    initializer=ParallelFrameRenderer._initialize_worker,
+                    initargs=(memory.name, self.base_image_array.shape, self.base_image_array.dtype.str,
+                              self.geometry, self.arguments)) as executor:
+                pending = collections.deque()
+                for y, trace_count in zip(parameter_values, trace_counts):
+                    pending.append(executor.submit(ParallelFrameRenderer._render_frame, y, trace_count))
+                    if len(pending) >= 2 * self.workers:
+                        yield self._frame(pending.popleft().result())
+                while pending:
+                    yield self._frame(pending.popleft().result())
+            del shared_base
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def _frame(self, image_array: np.ndarray) -> PlottingImage:
+        """Wraps an image array rendered by a worker as a frame of the canvas."""
+        instrumentation.count("frames rendered")
+        x_bounds, y_bounds, a_size, b_size, storage = self.geometry
+        frame = PlottingImage(x_bounds, y_bounds, a_size, b_size, show_axes=False,
+                              base_image_array=self.visualizer.canvas.base_image_array, storage=storage)
+        frame.image_array = image_array
+        return frame
+
+    @staticmethod
+    def _initialize_worker(memory_name: str,
+                           shape: tuple[int, ...],
+                           dtype: str,
+                           geometry: tuple,
+                           arguments: tuple
+                           ) -> None:
+        """Attaches a worker process to the shared base image."""
+        x_bounds, y_bounds, a_size, b_size, storage = geometry
+        memory = shared_memory.SharedMemory(name=memory_name)
+        visualizer = DataVisualizer(x_bounds, y_bounds, a_size, b_size, storage=storage)
+        visualizer.line_thickness = arguments[4]
+        visualizer.canvas.update_base_image(np.ndarray(shape, np.dtype(dtype), buffer=memory.buf))
+        ParallelFrameRenderer._worker_memory = memory
+        ParallelFrameRenderer._worker_visualizer = visualizer
+        ParallelFrameRenderer._worker_arguments = arguments
+
+    @staticmethod
+    def _render_frame(y: np.ndarray, trace_count: int) -> np.ndarray:
+        """Renders a single frame in a worker process."""
+        visualizer = ParallelFrameRenderer._worker_visualizer
+        x, parameter_color, trace, overlap, line_thickness = ParallelFrameRenderer._worker_arguments
+        visualizer.canvas.clear()
+        if trace is not None and trace_count:
+            trace_x, trace_y, trace_color = trace
+            visualizer.canvas.plot(trace_x[:trace_count], trace_y[:trace_count], line_thickness, color=trace_color,
+                                   connect=True)
+        visualizer._plot_parameter_values(x, y, parameter_color, overlap)
+        return visualizer.canvas.image_array
+
+class SampledFunction:
+    """A function represented by its values on an evenly spaced grid. Evaluating
+    it linearly interpolates between the grid points, and it is taken to be zero
+    outside of the grid. Sums, scalar multiples and convolutions of sampled
+    functions are computed directly on the arrays, so composed expressions do
+    not need to be re-evaluated through chains of closures."""
+    __slots__ = ("grid", "values")
+
+    def __init__(self, grid: np.ndarray, values: np.ndarray):
+        self.grid = grid
+        self.values = values
+
+    def __call__(self, x: float | np.ndarray) -> float | np.ndarray:
+        return np.interp(x, self.grid, self.values, left=0., right=0.)
+
+    def __add__(self, other: typing.Callable[[float], float]) -> typing.Self:
+        if not callable(other):
+            return NotImplemented
+        return SampledFunction(self.grid, self.values + self._sample_onto_grid(other))
+
+    __radd__ = __add__
+
+    def __sub__(self, other: typing.Callable[[float], float]) -> typing.Self:
+        if not callable(other):
+            return NotImplemented
+        return SampledFunction(self.grid, self.values - self._sample_onto_grid(other))
+
+    def __mul__(self, scalar: float) -> typing.Self:
+        if not isinstance(scalar, (int, float, np.number)):
+            return NotImplemented
+        return SampledFunction(self.grid, scalar * self.values)
+
+    __rmul__ = __mul__
+
+    def __neg__(self) -> typing.Self:
+        return SampledFunction(self.grid, -self.values)
+
+    def _sample_onto_grid(self, other: typing.Callable[[float], float]) -> np.ndarray:
+        """Values of another function at the points of this grid."""
+        if isinstance(other, SampledFunction) and other.grid is self.grid:
+            return other.values
+        return other(self.grid)
+
+    @property
+    def spacing(self) -> float:
+        """Distance between neighbouring points of the grid."""
+        return self.grid[1] - self.grid[0]
+
+    @property
+    def support(self) -> tuple[float, float]:
+        """Bounds of the interval outside of which the function is zero."""
+        nonzero = np.flatnonzero(self.values)
+        if not len(nonzero):
+            return (self.grid[0], self.grid[0])
+        # interpolation spreads nonzero values up to the neighbouring grid points
+        lower = self.grid[max(nonzero[0] - 1, 0)]
+        upper = self.grid[min(nonzero[-1] + 1, len(self.grid) - 1)]
+        return (lower, upper)
+
+    def convolve(self, other: typing.Callable[[float], float], method: str = "fft") -> typing.Self:
+        """Returns the convolution of this function with another function,
+        sampled on the same grid."""
+        values = Convolution._grid_convolve(self.spacing * self.values, other, self.spacing, method)
+        return SampledFunction(self.grid, values)
+
+class SeparableFunction:
+    """A function of x and y that is the product f_x(x) * f_y(y) of two functions
+    of a single variable. Convolution2D convolves separable functions one axis
+    at a time with the convolutions of a single variable."""
+    __slots__ = ("f_x", "f_y")
+
+    def __init__(self, f_x: typing.Callable[[float], float], f_y: typing.Callable[[float], float]):
+        self.f_x = f_x
+        self.f_y = f_y
+
+    def __call__(self, x: float | np.ndarray, y: float | np.ndarray) -> float | np.ndarray:
+        return self.f_x(x) * self.f_y(y)
+
+class SampledFunction2D:
+    """A function of x and y represented by its values on an evenly spaced grid,
+    with values indexed [y, x]. Evaluating it interpolates bilinearly between the
+    grid points, and it is taken to be zero outside of the grid."""
+    __slots__ = ("x_grid", "y_grid", "values")
+
+    def __init__(self, x_grid: np.ndarray, y_grid: np.ndarray, values: np.ndarray):
+        self.x_grid = x_grid
+        self.y_grid = y_grid
+        self.values = values
+
+    def __call__(self, x: float | np.ndarray, y: float | np.ndarray) -> float | np.ndarray:
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        column, x_weight, x_inside = self._cell(x, self.x_grid)
+        row, y_weight, y_inside = self._cell(y, self.y_grid)
+        values = self.values
+        out = ((1 - y_weight) * ((1 - x_weight) * values[row, column] + x_weight * values[row, column + 1]) +
+               y_weight * ((1 - x_weight) * values[row + 1, column] + x_weight * values[row + 1, column + 1]))
+        out = np.where(x_inside & y_inside, out, 0.)
+        return out if out.ndim else out[()]
+
+    @staticmethod
+    def _cell(x: np.ndarray, grid: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Index of the grid cell holding each point, the position of the point
+        within its cell from 0 to 1, and whether the point lies on the grid."""
+        position = (x - grid[0]) / (grid[1] - grid[0])
+        index = np.clip(np.floor(position).astype(int), 0, len(grid) - 2)
+        return index, position - index, (x >= grid[0]) & (x <= grid[-1])
+
+class ConvolutionCache:
+    """A least recently used cache of convolutions, keyed by the identities of the
+    two functions along with every parameter of the Convolution that computed
+    them that affects the result. Once the arrays held by the cached results
+    exceed max_bytes, the least recently used results are evicted, with each
+    result counted as at least min_entry_bytes, so that results holding few or
+    no arrays, such as closed forms, still count towards the limit. The cached
+    results are shared between callers, and should not be modified. Along with
+    each result, the Refinement that chose its sample width is kept, if any."""
+    min_entry_bytes = 2**10
+
+    def __init__(self, max_bytes: int = 256 * 2**20):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+
+    @staticmethod
+    def _identity(function: typing.Callable) -> tuple:
+        """Identity of a function, treating bound methods of the same object as identical."""
+        if inspect.ismethod(function):
+            return (id(function.__func__), id(function.__self__))
+        return (id(function),)
+
+    @classmethod
+    def _nbytes(cls, result: typing.Callable) -> int:
+        """The number of bytes held in arrays by a cached convolution, and at least min_entry_bytes."""
+        if isinstance(result, SampledFunction):
+            return max(result.values.nbytes, cls.min_entry_bytes)
+        cells = result.__closure__ or ()
+        return max(sum(cell.cell_contents.nbytes for cell in cells
+                       if isinstance(cell.cell_contents, np.ndarray)), cls.min_entry_bytes)
+
+    def key(self,
+            convolution: "Convolution",
+            f: typing.Callable[[float], float],
+            g: typing.Callable[[float], float]
+            ) -> tuple:
+        """The key under which the convolution of f and g is cached."""
+        return (self._identity(f), self._identity(g), convolution.sample_width,
+                convolution.x_min, convolution.x_max, convolution.method, convolution.tolerance,
+                convolution.min_sample_width, convolution.closed_forms, convolution.trim_support)
+
+    def get(self, key: tuple) -> tuple[typing.Callable[[float], float], "Refinement | None"] | None:
+        """Returns the cached convolution for the key along with its refinement, or
+        None if it is not cached."""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0], entry[3]
+
+    def put(self,
+            key: tuple,
+            result: typing.Callable[[float], float],
+            operands: tuple[typing.Callable, typing.Callable],
+            refinement: "Refinement | None" = None
+            ) -> None:
+        """Caches a convolution, evicting the least recently used ones if needed.
+        References to the operands are kept so that their identities stay valid
+        for as long as the entry is cached."""
+        nbytes = self._nbytes(result)
+        if nbytes > self.max_bytes:
+            return
+        if key in self._entries:
+            self.current_bytes -= self._entries.pop(key)[2]
+        self._entries[key] = (result, operands, nbytes, refinement)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes:
+            _, (_, _, evicted_bytes, _) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def clear(self) -> None:
+        """Removes all cached convolutions, keeping the statistics."""
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self) -> dict:
+        """Hit, miss and eviction counts along with the current size of the cache."""
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes}
+
+    def __len__(self):
+        return len(self._entries)
+
+class ClosedForm:
+    """An exact representation of a function, as a sum of pieces that are each
+    a polynomial times an exponential on an interval, along with an optional
+    normalized Gaussian. Each piece is a tuple (lower, upper, coefficients, rate)
+    standing for sum(coefficients[k] * x**k) * exp(rate * x) for lower <= x < upper.
+    The convolution of two closed forms is evaluated exactly, without sampling."""
+    __slots__ = ("pieces", "gaussian_width")
+
+    # vectorized, as numpy does not provide the error function
+    _erf = np.vectorize(math.erf, otypes=[float])
+
+    def __init__(self,
+                 pieces: typing.Sequence[tuple[float, float, tuple[float, ...], float]] = (),
+                 gaussian_width: float | None = None):
+        self.pieces = tuple(pieces)
+        # width a of the Gaussian exp(-(x/a)**2) / (a * sqrt(pi))
+        self.gaussian_width = gaussian_width
+
+    def __call__(self, x: float | np.ndarray) -> float | np.ndarray:
+        x = np.asarray(x, dtype=float)
+        out = np.zeros(x.shape)
+        for lower, upper, coefficients, rate in self.pieces:
+            inside = (x >= lower) & (x < upper)
+            polynomial = sum(c * x**k for k, c in enumerate(coefficients))
+            out += np.where(inside, polynomial * np.exp(rate * np.where(inside, x, 0.)), 0.)
+        if self.gaussian_width is not None:
+            out += self._gaussian(x, self.gaussian_width**2 / 2)
+        return out
+
+    def convolve(self, other: typing.Self) -> typing.Callable[[float], float]:
+        """Returns the exact convolution of this function with another closed form."""
+        def convolution(x: float | np.ndarray) -> float | np.ndarray:
+            instrumentation.count("convolution points evaluated", np.size(x))
+            is_array = type(x) == np.ndarray
+            x = np.asarray(x, dtype=float)
+            out = np.zeros(x.shape)
+            for piece in self.pieces:
+                for other_piece in other.pieces:
+                    out += self._piece_convolution(x, piece, other_piece)
+                if other.gaussian_width is not None:
+                    out += self._gaussian_piece_convolution(x, other.gaussian_width**2 / 2, piece)
+            if self.gaussian_width is not None:
+                variance = self.gaussian_width**2 / 2
+                for other_piece in other.pieces:
+                    out += self._gaussian_piece_convolution(x, variance, other_piece)
+                if other.gaussian_width is not None:
+                    out += self._gaussian(x, variance + other.gaussian_width**2 / 2)
+            return out if is_array else out[()]
+        return convolution
+
+    @staticmethod
+    def _gaussian(x: np.ndarray, variance: float) -> np.ndarray:
+        """Normal probability density with mean 0 and the given variance."""
+        return np.exp(-x**2 / (2 * variance)) / np.sqrt(2 * np.pi * variance)
+
+    @staticmethod
+    def _piece_convolution(x: np.ndarray, piece: tuple, other_piece: tuple) -> np.ndarray:
+        """Exact convolution of two pieces, integrating p(s) q(x - s) exp(rate * s)
+        exp(other_rate * (x - s)) over the overlap of the two intervals."""
+        lower, upper, p, rate = piece
+        other_lower, other_upper, q, other_rate = other_piece
+        low = np.maximum(lower, x - other_upper)
+        high = np.maximum(np.minimum(upper, x - other_lower), low)
+        # coefficients of the powers of s in p(s) q(x - s)
+        c = [np.zeros(x.shape) for _ in range(len(p) + len(q) - 1)]
+        for i, p_i in enumerate(p):
+            for j, q_j in enumerate(q):
+                for m in range(j + 1):
+                    c[i + m] = c[i + m] + p_i * q_j * math.comb(j, m) * (-1)**m * x**(j - m)
+        alpha = rate - other_rate
+        out = np.zeros(x.shape)
+        for k, c_k in enumerate(c):
+            if alpha == 0:
+                moment = np.exp(other_rate * x) * (high**(k + 1) - low**(k + 1)) / (k + 1)
+            else:
+                # antiderivative of s**k exp(alpha * s + other_rate * x), by parts
+                def antiderivative(s):
+                    terms = sum((-1)**r * math.perm(k, r) * s**(k - r) / alpha**(r + 1) for r in range(k + 1))
+                    return np.exp(alpha * s + other_rate * x) * terms
+                moment = antiderivative(high) - antiderivative(low)
+            out += c_k * moment
+        return out
+
+    @classmethod
+    def _gaussian_piece_convolution(cls, x: np.ndarray, variance: float, piece: tuple) -> np.ndarray:
+        """Exact convolution of a normal density with the given variance and a piece.
+        Completing the square turns exp(rate * s) times the density at x - s into a
+        shifted density, whose moments over the interval follow by recursion."""
+        lower, upper, p, rate = piece
+        sigma = np.sqrt(variance)
+        mean = x + rate * variance
+        scale = np.exp(rate * x + rate**2 * variance / 2)
+        a = lower - mean
+        b = upper - mean
+        def density_term(u, k):
+            # u**k times the density, vanishing at infinite bounds
+            with np.errstate(invalid="ignore"):
+                return np.where(np.isfinite(u), u**k * cls._gaussian(u, variance), 0.)
+        # moments of u over [a, b] under the normal density
+        moments = [0.5 * (cls._erf(b / (sigma * np.sqrt(2))) - cls._erf(a / (sigma * np.sqrt(2))))]
+        if len(p) > 1:
+            moments.append(variance * (density_term(a, 0) - density_term(b, 0)))
+        for k in range(2, len(p)):
+            moments.append(variance * ((k - 1) * moments[k - 2]
+                                       + density_term(a, k - 1) - density_term(b, k - 1)))
+        # expanding p(mean + u) in powers of u
+        out = np.zeros(x.shape)
+        for i, p_i in enumerate(p):
+            for k in range(i + 1):
+                out += p_i * math.comb(i, k) * mean**(i - k) * moments[k]
+        return scale * out
+
+class Refinement(typing.NamedTuple):
+    """The outcome of adaptively refining the sample width of a convolution."""
+    sample_width: float # the width used for the returned convolution
+    error_estimate: float # estimated maximum error of the returned convolution
+    order: float # the estimated order of convergence in the sample width
+    levels: int # the number of sample widths that were computed
+
 class Convolution:
     """Contains the parameters for calculating the convolution of two functions.
     Shrinking the sample_width will lead to more precise computation of the convolution,
-    but greatly increases computation time."""
-    def __init__(self, sample_width: float, xbounds: tuple[float, float]):
+    but greatly increases computation time when using the direct method.
+
+    The method selects how the convolution is evaluated: "direct" sums over the
+    sampling for every point it is queried at, and is kept as the reference
+    implementation, while "fft" computes the sampled convolution on the whole
+    sampling grid at once and answers queries by linear interpolation.
+
+    Arrays of query points are evaluated in vectorized blocks, each holding at most
+    max_chunk_elements differences between query points and sampling points, so
+    that large query arrays do not need to be held in memory all at once.
+
+    If either function passed to convolve is a SampledFunction, the convolution
+    is computed on the sampling grid and returned as a SampledFunction, so that
+    nested convolutions are evaluated on arrays rather than through closures.
+
+    Passing a ConvolutionCache makes repeated convolutions of the same pair of
+    functions return the previously computed result.
+
+    With trim_support, the direct method only sums over the sampling points where
+    both functions can be nonzero. The support of f is found from its samples,
+    while the support of g is taken from ConvolutionFunctions.support_of, or from
+    the values of a SampledFunction, and is otherwise assumed to be unbounded.
+
+    Given a tolerance, sample_width is only the coarsest width tried. Each
+    convolution is then computed at successively halved sample widths, down to
+    min_sample_width, with the error at each width estimated by Richardson
+    extrapolation from the differences between levels. The coarsest width whose
+    estimated error meets the tolerance is used, and is recorded along with the
+    estimated error in last_refinement.
+
+    With closed_forms, convolutions of two functions that have a closed form
+    registered in ConvolutionFunctions.closed_forms are evaluated exactly instead,
+    over the whole real line rather than only over the bounds of the sampling."""
+    methods = ("direct", "fft")
+
+    def __init__(self,
+                 sample_width: float,
+                 xbounds: tuple[float, float],
+                 method: str = "direct",
+                 max_chunk_elements: int = 2**20,
+                 cache: ConvolutionCache | None = None,
+                 trim_support: bool = True,
+                 tolerance: float | None = None,
+                 min_sample_width: float = 1e-4,
+                 closed_forms: bool = True):
+        if method not in self.methods:
+            raise ValueError(f"Unknown convolution method {method!r}, expected one of {self.methods}.")
         self.sample_width = sample_width
+        self.method = method
+        self.max_chunk_elements = max_chunk_elements
+        self.cache = cache
+        self.trim_support = trim_support
+        self.tolerance = tolerance
+        self.min_sample_width = min_sample_width
+        self.closed_forms = closed_forms
+        self.last_refinement = None
         self.x_min = xbounds[0]
         self.x_max = xbounds[1]
         self.sample_count = 1 + int((self.x_max - self.x_min) / self.sample_width)
         self.sampling = np.linspace(self.x_min, self.x_max, self.sample_count)
-        
+
     def convolve(self,
-                 f: typing.Callable[[float], float], 
+                 f: typing.Callable[[float], float],
                  g: typing.Callable[[float], float]
                  ) -> typing.Callable[[float], float]:
         """Returns a function that is the finitely sampled convolution of the functions
         f and g that it is passed. The precision of this sampling is determined by
         the containing instance."""
+        with instrumentation.timer("construct convolutions"):
+            if self.cache is None:
+                return self._uncached_convolve(f, g)
+            key = self.cache.key(self, f, g)
+            entry = self.cache.get(key)
+            if entry is not None:
+                result, refinement = entry
+                if refinement is not None:
+                    self.last_refinement = refinement
+                return result
+            previous_refinement, self.last_refinement = self.last_refinement, None
+            result = self._uncached_convolve(f, g)
+            refinement = self.last_refinement
+            if refinement is None:
+                self.last_refinement = previous_refinement
+            self.cache.put(key, result, (f, g), refinement)
+            return result
+
+    def _uncached_convolve(self,
+                           f: typing.Callable[[float], float],
+                           g: typing.Callable[[float], float]
+                           ) -> typing.Callable[[float], float]:
+        """Computes the convolution of f and g with the method of this instance."""
+        if self.closed_forms:
+            f_form = ConvolutionFunctions.closed_form_of(f)
+            g_form = ConvolutionFunctions.closed_form_of(g)
+            if f_form is not None and g_form is not None:
+                return f_form.convolve(g_form)
+        if self.tolerance is not None:
+            result, self.last_refinement = self.refine(f, g)
+            return result
+        if isinstance(f, SampledFunction) or isinstance(g, SampledFunction):
+            return self._sampled_convolve(f, g)
+        if self.method == "fft":
+            return self._fft_convolve(f, g)
+        return self._direct_convolve(f, g)
+
+    def refine(self,
+               f: typing.Callable[[float], float],
+               g: typing.Callable[[float], float]
+               ) -> tuple[typing.Callable[[float], float], Refinement]:
+        """Returns the convolution of f and g at the coarsest sample width whose
+        estimated error is within the tolerance, along with the chosen width and
+        its estimated error. The error is estimated over the sampling grid of this
+        instance, assuming it behaves as C * width**order, with the order estimated
+        from the last three levels and taken to be 1 until three levels exist."""
+        tolerance = self.tolerance if self.tolerance is not None else 0.
+        width = self.sample_width
+        results = [self._at_width(width).convolve(f, g)]
+        values = [np.asarray(results[0](self.sampling))]
+        order = 1.
+        while True:
+            finer_width = width / 2
+            if finer_width < self.min_sample_width:
+                # the finest width is returned with the last error estimate available
+                error = np.inf if len(values) < 2 else differences[-1] / (2**order - 1)
+                return results[-1], Refinement(width, error, order, len(results))
+            results.append(self._at_width(finer_width).convolve(f, g))
+            values.append(np.asarray(results[-1](self.sampling)))
+            differences = [np.abs(values[i + 1] - values[i]).max() for i in range(len(values) - 1)]
+            if len(differences) >= 2 and differences[-1] > 0 and differences[-2] > 0:
+                order = float(np.clip(np.log2(differences[-2] / differences[-1]), 0.5, 4.))
+            # the error of the coarser level is its difference from the extrapolated limit
+            error = differences[-1] * 2**order / (2**order - 1)
+            if error <= tolerance:
+                return results[-2], Refinement(width, error, order, len(results))
+            width = finer_width
+
+    def _at_width(self, sample_width: float) -> typing.Self:
+        """A copy of this instance with a fixed sample width, used for refinement."""
+        return Convolution(sample_width,
+                           (self.x_min, self.x_max),
+                           method=self.method,
+                           max_chunk_elements=self.max_chunk_elements,
+                           trim_support=self.trim_support,
+                           closed_forms=self.closed_forms)
+
+    def _direct_convolve(self,
+                         f: typing.Callable[[float], float],
+                         g: typing.Callable[[float], float]
+                         ) -> typing.Callable[[float], float]:
+        """Returns the convolution of f and g, evaluated as a direct sum over the
+        sampling each time it is called."""
         # precompute the sampling of f and the multiplication by the sample width
         # so that it does not need to be repeated for each function call
         scaled_sampled_f = self.sample_width * f(self.sampling)
+        sampling = self.sampling
+        g_support = (-np.inf, np.inf)
+        if self.trim_support:
+            # samples where f is zero never contribute to the sum
+            nonzero = np.flatnonzero(scaled_sampled_f)
+            first, last = (nonzero[0], nonzero[-1] + 1) if len(nonzero) else (0, 0)
+            scaled_sampled_f = scaled_sampled_f[first:last]
+            sampling = sampling[first:last]
+            g_support = self.support(g)
         def convolution(x: float | np.ndarray) -> float | np.ndarray:
+            instrumentation.count("convolution points evaluated", np.size(x))
             if type(x) == np.ndarray:
-                out = []
-                for x_value in x:
-                    out.append((scaled_sampled_f * g(x_value - self.sampling)).sum())
-                return np.asarray(out)
+                return self._batched_sum(scaled_sampled_f, sampling, g, g_support, x)
             else:
-                return (scaled_sampled_f * g(x - self.sampling)).sum()
+                return self._batched_sum(scaled_sampled_f, sampling, g, g_support, np.array([x]))[0]
         return convolution
 
+    def _batched_sum(self,
+                     scaled_sampled_f: np.ndarray,
+                     sampling: np.ndarray,
+                     g: typing.Callable[[float], float],
+                     g_support: tuple[float, float],
+                     x: np.ndarray
+                     ) -> np.ndarray:
+        """Evaluates the direct sum for every point in x, one block of rows of
+        the matrix of differences x - sampling at a time. The points of x are
+        visited in sorted order, and each block only includes the columns
+        where g(x - sampling) can be nonzero for the points in the block."""
+        flat_x = x.ravel()
+        order = np.argsort(flat_x, kind="stable")
+        sorted_x = flat_x[order]
+        out = np.empty(len(flat_x))
+        g_lower, g_upper = g_support
+        start = 0
+        while start < len(sorted_x):
+            # keeping each block within the width of the support of g bounds its columns
+            stop = max(start + 1, np.searchsorted(sorted_x, sorted_x[start] + (g_upper - g_lower), "right"))
+            first = np.searchsorted(sampling, sorted_x[start] - g_upper, "left")
+            last = np.searchsorted(sampling, sorted_x[stop - 1] - g_lower, "right")
+            rows = max(1, self.max_chunk_elements // max(1, last - first))
+            if stop - start > rows:
+                stop = start + rows
+                last = np.searchsorted(sampling, sorted_x[stop - 1] - g_lower, "right")
+            block = sorted_x[start:stop]
+            columns = slice(first, max(first, last))
+            with instrumentation.timer("direct sums"):
+                out[order[start:stop]] = g(block[:, np.newaxis] - sampling[columns]) @ scaled_sampled_f[columns]
+            instrumentation.count("g evaluations")
+            instrumentation.count("g points evaluated", len(block) * (columns.stop - columns.start))
+            start = stop
+        return out.reshape(x.shape)
+
+    def support(self, function: typing.Callable[[float], float]) -> tuple[float, float]:
+        """Bounds of the interval outside of which the function is known to be zero."""
+        if isinstance(function, SampledFunction):
+            return function.support
+        declared = ConvolutionFunctions.support_of(function)
+        if declared is None:
+            return (-np.inf, np.inf)
+        return declared
+
+    def _fft_convolve(self,
+                      f: typing.Callable[[float], float],
+                      g: typing.Callable[[float], float]
+                      ) -> typing.Callable[[float], float]:
+        """Returns the convolution of f and g, computed once on the sampling grid
+        with an FFT and linearly interpolated between grid points. Points outside
+        of the bounds of the sampling fall back to the direct sum."""
+        grid_values = self._grid_convolve(self.sample_width * f(self.sampling), g, self._spacing, "fft")
+        direct = self._direct_convolve(f, g)
+        def convolution(x: float | np.ndarray) -> float | np.ndarray:
+            if type(x) == np.ndarray:
+                out = np.interp(x, self.sampling, grid_values)
+                outside = (x < self.x_min) | (x > self.x_max)
+                # points outside are counted by the direct sum
+                instrumentation.count("convolution points evaluated", x.size - np.count_nonzero(outside))
+                if outside.any():
+                    out[outside] = direct(x[outside])
+                return out
+            else:
+                if x < self.x_min or x > self.x_max:
+                    return direct(x)
+                instrumentation.count("convolution points evaluated")
+                return np.interp(x, self.sampling, grid_values)
+        return convolution
+
+    def _sampled_convolve(self,
+                          f: typing.Callable[[float], float],
+                          g: typing.Callable[[float], float]
+                          ) -> SampledFunction:
+        """Returns the convolution of f and g as a SampledFunction on the sampling grid."""
+        values = self._grid_convolve(self.sample_width * f(self.sampling), g, self._spacing, self.method)
+        return SampledFunction(self.sampling, values)
+
+    def sample(self, f: typing.Callable[[float], float]) -> SampledFunction:
+        """Returns the function f sampled on the sampling grid."""
+        if isinstance(f, SampledFunction) and f.grid is self.sampling:
+            return f
+        return SampledFunction(self.sampling, f(self.sampling))
+
+    @property
+    def _spacing(self) -> float:
+        """The actual distance between neighbouring sampling points."""
+        if self.sample_count > 1:
+            return self.sampling[1] - self.sampling[0]
+        return self.sample_width
+
+    @classmethod
+    def _grid_convolve(cls,
+                       scaled_sampled_f: np.ndarray,
+                       g: typing.Callable[[float], float],
+                       spacing: float,
+                       method: str
+                       ) -> np.ndarray:
+        """Values of the sampled convolution at each point of an evenly spaced grid,
+        given the samples of f on that grid already multiplied by the sample width."""
+        n = len(scaled_sampled_f)
+        # g is needed at every difference of two grid points
+        sampled_g = g(spacing * np.arange(1 - n, n))
+        instrumentation.count("g evaluations")
+        instrumentation.count("g points evaluated", 2 * n - 1)
+        linear_convolve = cls._padded_fft_convolve if method == "fft" else np.convolve
+        return linear_convolve(scaled_sampled_f, sampled_g)[n - 1:2 * n - 1]
+
+    def sample_all(self, functions: typing.Iterable[typing.Callable[[float], float]]) -> np.ndarray:
+        """Samples every function onto the sampling grid, as the rows of a single array."""
+        return np.stack([f(self.sampling) for f in functions])
+
+    def sample_shifted(self,
+                       functions: typing.Iterable[typing.Callable[[float], float]],
+                       x: np.ndarray
+                       ) -> np.ndarray:
+        """Evaluates every function at each point of x minus each point of the sampling
+        grid, indexed [function, x, grid point]. These are the values of g that the
+        direct sum weights by the samples of f to evaluate f * g at x, so that with
+        sample_all, the direct sums for every pair of functions take one product."""
+        shifts = np.asarray(x)[..., np.newaxis] - self.sampling
+        return np.stack([g(shifts) for g in functions])
+
+    def convolve_sampled(self, f_values: np.ndarray, g_values: np.ndarray) -> np.ndarray:
+        """Convolves functions given by their values on the sampling grid along the
+        last axis of each array, returning the values of the convolutions on the
+        sampling grid. The leading axes broadcast against each other, so that for
+        example the convolutions of every pair of rows of a stacked array of
+        samples are computed by a single batched FFT. As with SampledFunction,
+        the functions are taken to be zero outside of the grid."""
+        n = self.sample_count
+        g_differences = self.evaluate_sampled(g_values, self._spacing * np.arange(1 - n, n))
+        return self._padded_fft_convolve(self.sample_width * f_values, g_differences)[..., n - 1:2 * n - 1]
+
+    def evaluate_sampled(self, values: np.ndarray, x: float | np.ndarray) -> np.ndarray:
+        """Linearly interpolates functions given by their values on the sampling grid
+        along the last axis of values at the points x, being zero outside of the grid."""
+        position = (np.asarray(x) - self.x_min) / self._spacing
+        lower = np.clip(np.floor(position).astype(int), 0, max(self.sample_count - 2, 0))
+        upper = np.minimum(lower + 1, self.sample_count - 1)
+        fraction = position - lower
+        # the tolerance keeps the bounds themselves inside despite rounding
+        inside = (position >= -1e-9) & (position <= self.sample_count - 1 + 1e-9)
+        return (values[..., lower] * (1 - fraction) + values[..., upper] * fraction) * inside
+
+    @staticmethod
+    def _padded_fft_convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Full discrete linear convolution along the last axes of the arrays a and b,
+        computed with a zero-padded real FFT. For one-dimensional arrays, this is
+        equivalent to np.convolve(a, b), while leading axes are broadcast."""
+        length = a.shape[-1] + b.shape[-1] - 1
+        # a power of two keeps the transform fast regardless of the sample count
+        fft_size = 1 << (length - 1).bit_length()
+        product = np.fft.rfft(a, fft_size) * np.fft.rfft(b, fft_size)
+        return np.fft.irfft(product, fft_size)[..., :length]
+
+class Convolution2D:
+    """Contains the parameters for calculating the convolution of two functions of
+    x and y, sampled on a grid with the same sample_width along both axes over
+    xbounds and ybounds. The result is returned as a function of x and y.
+
+    With separable, convolutions of functions that factor into a function of x
+    times a function of y are computed as two convolutions of a single variable,
+    one along each axis. SeparableFunction arguments are factored as given, and
+    their factors are convolved with Convolution, which uses their closed forms
+    if both have one. Other functions are sampled, and are factored if their
+    samples form a matrix of rank one within tolerance. Pairs of functions that
+    do not both factor are convolved with a two-dimensional FFT."""
+
+    def __init__(self,
+                 sample_width: float,
+                 xbounds: tuple[float, float],
+                 ybounds: tuple[float, float],
+                 separable: bool = True,
+                 tolerance: float = 1e-9):
+        self.sample_width = sample_width
+        self.separable = separable
+        self.tolerance = tolerance
+        # the convolutions along each axis also provide the sampling of that axis
+        self.x_convolution = Convolution(sample_width, xbounds, method="fft")
+        self.y_convolution = Convolution(sample_width, ybounds, method="fft")
+        self.last_path = None
+
+    def convolve(self,
+                 f: typing.Callable[[float, float], float],
+                 g: typing.Callable[[float, float], float]
+                 ) -> typing.Callable[[float, float], float]:
+        """Returns a function of x and y that is the sampled convolution of f and g.
+        The path taken, "separable" or "fft", is recorded in last_path."""
+        with instrumentation.timer("construct convolutions"):
+            if self.separable and isinstance(f, SeparableFunction) and isinstance(g, SeparableFunction):
+                self.last_path = "separable"
+                return SeparableFunction(self.x_convolution.convolve(f.f_x, g.f_x),
+                                         self.y_convolution.convolve(f.f_y, g.f_y))
+            x_sampling, y_sampling = self.x_convolution.sampling, self.y_convolution.sampling
+            x_spacing, y_spacing = self.x_convolution._spacing, self.y_convolution._spacing
+            # g is needed at every difference of two grid points
+            x_differences = x_spacing * np.arange(1 - len(x_sampling), len(x_sampling))
+            y_differences = y_spacing * np.arange(1 - len(y_sampling), len(y_sampling))
+            f_factors = self._factors(f, x_sampling, y_sampling)
+            g_factors = self._factors(g, x_differences, y_differences)
+            if self.separable and not isinstance(f_factors, np.ndarray) and not isinstance(g_factors, np.ndarray):
+                self.last_path = "separable"
+                (f_x, f_y), (g_x, g_y) = f_factors, g_factors
+                values = np.outer(self._axis_convolve(y_spacing * f_y, g_y),
+                                  self._axis_convolve(x_spacing * f_x, g_x))
+            else:
+                self.last_path = "fft"
+                f_values = f_factors if isinstance(f_factors, np.ndarray) else np.outer(f_factors[1], f_factors[0])
+                g_values = g_factors if isinstance(g_factors, np.ndarray) else np.outer(g_factors[1], g_factors[0])
+                values = self._padded_fft_convolve2d(x_spacing * y_spacing * f_values, g_values)
+                values = values[len(y_sampling) - 1:2 * len(y_sampling) - 1, len(x_sampling) - 1:2 * len(x_sampling) - 1]
+            return SampledFunction2D(x_sampling, y_sampling, values)
+
+    def _factors(self,
+                 f: typing.Callable[[float, float], float],
+                 x: np.ndarray,
+                 y: np.ndarray
+                 ) -> tuple[np.ndarray, np.ndarray] | np.ndarray:
+        """The samples of f on the grid of x and y, as a pair of factors along x and
+        along y if f is separable, or as an array indexed [y, x] otherwise."""
+        if isinstance(f, SeparableFunction):
+            return f.f_x(x), f.f_y(y)
+        values = f(x[np.newaxis, :], y[:, np.newaxis])
+        if not self.separable:
+            return values
+        # a matrix of rank one is the outer product of any of its rows and columns,
+        # which are taken through its largest element to keep the factors accurate
+        row, column = np.unravel_index(np.argmax(np.abs(values)), values.shape)
+        pivot = values[row, column]
+        if pivot == 0:
+            return np.zeros(len(x)), np.zeros(len(y))
+        f_x, f_y = values[row] / pivot, values[:, column]
+        if np.abs(values - np.outer(f_y, f_x)).max() > self.tolerance * abs(pivot):
+            return values
+        return f_x, f_y
+
+    @staticmethod
+    def _axis_convolve(scaled_f: np.ndarray, g_differences: np.ndarray) -> np.ndarray:
+        """Sampled convolution along one axis, given the samples of f already multiplied
+        by the spacing, and the samples of g at every difference of two grid points."""
+        n = len(scaled_f)
+        return Convolution._padded_fft_convolve(scaled_f, g_differences)[n - 1:2 * n - 1]
+
+    @staticmethod
+    def _padded_fft_convolve2d(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Full discrete linear convolution of the two-dimensional arrays a and b,
+        computed with a zero-padded real FFT along both axes."""
+        shape = (a.shape[0] + b.shape[0] - 1, a.shape[1] + b.shape[1] - 1)
+        fft_shape = tuple(1 << (length - 1).bit_length() for length in shape)
+        product = np.fft.rfft2(a, fft_shape) * np.fft.rfft2(b, fft_shape)
+        return np.fft.irfft2(product, fft_shape)[:shape[0], :shape[1]]
+
 class ConvolutionFunctions:
     """A class containing all the relevant functions for convolution and plotting.
     Also supports iteration through all the represented functions (except for the 
-    Dirac delta which also requires a normalization argument)."""
+    Dirac delta which also requires a normalization argument).
+
+    The names of all of the functions, including the delta, are listed in names,
+    so that they can be given by name, as in manifests. The supports of the
+    functions centered at t = 0 are listed in supports, so
+    that convolutions can skip the regions where the functions are zero, and
+    their exact closed forms are listed in closed_forms, so that convolutions
+    between them can be computed exactly."""
+    names = ("rectangle", "right_triangle", "isoceles_triangle", "exponential", "delta")
+    supports = {"rectangle": (-0.5, 0.5),
+                "right_triangle": (-0.5, 0.5),
+                "isoceles_triangle": (-1., 1.),
+                "exponential": (0., np.inf)}
+    closed_forms = {"rectangle": ClosedForm([(-0.5, 0.5, (1.,), 0.)]),
+                    "right_triangle": ClosedForm([(-0.5, 0.5, (0.5, -1.), 0.)]),
+                    "isoceles_triangle": ClosedForm([(-1., 0., (1., 1.), 0.), (0., 1., (1., -1.), 0.)]),
+                    "exponential": ClosedForm([(0., np.inf, (1.,), -1.)]),
+                    "delta": ClosedForm(gaussian_width=0.01)}
+
     def __init__(self):
         self.functions = [self.rectangle,
                           self.right_triangle,
@@ -415,57 +1837,198 @@ class ConvolutionFunctions:
         for these computations."""
         return np.exp(-((x-t)/a)**2) / (np.abs(a) * np.sqrt(np.pi))
 
+    @classmethod
+    def support_of(cls, function: typing.Callable[[float], float]) -> tuple[float, float] | None:
+        """Returns the support of one of the functions of this class, or the support
+        declared by any other function through a support attribute, if it has one."""
+        if inspect.ismethod(function) and function.__self__ is cls and function.__name__ in cls.supports:
+            return cls.supports[function.__name__]
+        return getattr(function, "support", None)
+
+    @classmethod
+    def closed_form_of(cls, function: typing.Callable[[float], float]) -> ClosedForm | None:
+        """Returns the closed form of one of the functions of this class, or None
+        if the function is not one of them."""
+        if inspect.ismethod(function) and function.__self__ is cls and function.__name__ in cls.closed_forms:
+            return cls.closed_forms[function.__name__]
+        return None
+
     def __iter__(self):
         return (function for function in self.functions)
 
     def __len__(self):
         return len(self.functions)
 
+class ConvolutionFunctions2D:
+    """Functions of x and y for two-dimensional convolutions, centered at (t, s).
+    All of them apart from the disc are separable, and separable_triangle is
+    given as a SeparableFunction so that its factors have closed forms."""
+    separable_triangle = SeparableFunction(ConvolutionFunctions.isoceles_triangle,
+                                           ConvolutionFunctions.isoceles_triangle)
+
+    def __init__(self):
+        self.functions = [self.rectangle,
+                          self.separable_triangle,
+                          self.gaussian,
+                          self.disc]
+
+    @classmethod
+    def rectangle(cls, x: float, y: float, t: float = 0, s: float = 0) -> float:
+        """Square with height and side 1, centered at (t, s)."""
+        return ConvolutionFunctions.rectangle(x, t) * ConvolutionFunctions.rectangle(y, s)
+
+    @classmethod
+    def gaussian(cls, x: float, y: float, t: float = 0, s: float = 0, a: float = 0.25) -> float:
+        """Normalized Gaussian of width a, centered at (t, s)."""
+        return np.exp(-((x - t)**2 + (y - s)**2) / a**2) / (np.pi * a**2)
+
+    @classmethod
+    def disc(cls, x: float, y: float, t: float = 0, s: float = 0) -> float:
+        """Disc with height 1 and radius 0.5, centered at (t, s)."""
+        return np.array((x - t)**2 + (y - s)**2 < 0.25).astype(float)
+
+    def __iter__(self):
+        return (function for function in self.functions)
+
+    def __len__(self):
+        return len(self.functions)
+
+class RenderJob(typing.NamedTuple):
+    """The parameters of an animation of the convolution of two of the functions
+    of ConvolutionFunctions, given by name, as listed in a manifest. The digest
+    of a job covers all of its parameters, and is stored as a comment in the
+    file it renders, so that files that are up to date can be recognized."""
+    output: str
+    f: str
+    g: str
+    x_bounds: tuple[float, float]
+    y_bounds: tuple[float, float]
+    resolution: tuple[int, int]
+    frame_spacing: int = 1
+    g_is_delta: bool = False
+    title: str = ""
+    legend: tuple = ()
+    format: str = "gif"
+    storage: str = "uint8"
+
+    @classmethod
+    def from_dict(cls, job: dict) -> typing.Self:
+        """Creates a job from an entry of a manifest, checking the names of the functions."""
+        unknown = set(job) - set(cls._fields)
+        if unknown:
+            raise ValueError(f"Unknown parameters {sorted(unknown)} in the job for {job.get('output')!r}.")
+        for name in (job["f"], job["g"]):
+            if name not in ConvolutionFunctions.names:
+                raise ValueError(f"Unknown function {name!r} in the job for {job['output']!r}.")
+        if job.get("format", "gif") not in Animation.formats:
+            raise ValueError(f"Unknown animation format {job['format']!r} in the job for {job['output']!r}.")
+        return cls(**dict(job,
+                          x_bounds=tuple(job["x_bounds"]),
+                          y_bounds=tuple(job["y_bounds"]),
+                          resolution=tuple(job["resolution"]),
+                          legend=tuple((name, tuple(color)) for name, color in job.get("legend", ()))))
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of all of the parameters of the job."""
+        return hashlib.sha256(json.dumps(self._asdict(), sort_keys=True).encode()).hexdigest()
+
+    @property
+    def comment(self) -> str:
+        """The comment identifying the file rendered by this job."""
+        return f"convolution job sha256:{self.digest}"
+
+    def path(self, directory: str) -> str:
+        """Path of the file rendered by this job within the directory."""
+        return os.path.join(directory, self.output + Animation.extensions[self.format])
+
+    def is_rendered(self, directory: str) -> bool:
+        """Whether the file rendered by this job exists and holds the digest of its parameters."""
+        try:
+            with Image.open(self.path(directory)) as image:
+                if self.format == "gif":
+                    comment = image.info.get("comment", b"").decode(errors="replace")
+                else:
+                    comment = image.getexif().get(Animation.image_description_tag)
+        except (OSError, SyntaxError):
+            return False
+        return comment == self.comment
+
+    def render(self, directory: str, workers: int | None = None) -> str:
+        """Renders the animation into the directory, and returns the path of the file.
+        The file is written under a temporary name and then renamed, so that an
+        interrupted render never leaves a file that looks up to date."""
+        dv = DataVisualizer(self.x_bounds, self.y_bounds, *self.resolution, storage=self.storage)
+        plot = dv.visualize_convolution(getattr(ConvolutionFunctions, self.f),
+                                        getattr(ConvolutionFunctions, self.g),
+                                        frame_spacing=self.frame_spacing,
+                                        g_is_delta=self.g_is_delta,
+                                        workers=workers)
+        plot.add_title(self.title)
+        plot.add_legend(list(self.legend))
+        partial = os.path.join(directory, self.output + ".partial")
+        plot.save(partial, self.format, comment=self.comment)
+        os.replace(partial + Animation.extensions[self.format], self.path(directory))
+        return self.path(directory)
+
+def load_manifest(filename: str) -> list[RenderJob]:
+    """Reads the jobs listed in a JSON manifest, of the form {"jobs": [...]}."""
+    with open(filename) as fp:
+        jobs = [RenderJob.from_dict(job) for job in json.load(fp)["jobs"]]
+    outputs = collections.Counter(job.path("") for job in jobs)
+    duplicates = [output for output, count in outputs.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Several jobs in {filename} render to {duplicates}.")
+    return jobs
+
+def render_manifest(jobs: list[RenderJob],
+                    directory: str,
+                    concurrent_jobs: int | None = None,
+                    workers: int | None = None,
+                    force: bool = False
+                    ) -> list[RenderJob]:
+    """Renders the jobs whose files in the directory are not up to date, running up
+    to concurrent_jobs of them at once across a pool of processes, and returns
+    the jobs that were rendered."""
+    pending = [job for job in jobs if force or not job.is_rendered(directory)]
+    for job in jobs:
+        if job not in pending:
+            print(f"{job.path(directory)} is up to date")
+    if not pending:
+        return pending
+    os.makedirs(directory, exist_ok=True)
+    if concurrent_jobs == 1 or len(pending) == 1:
+        for job in pending:
+            print(f"rendered {job.render(directory, workers)}")
+        return pending
+    with concurrent.futures.ProcessPoolExecutor(max_workers=concurrent_jobs) as executor:
+        futures = [executor.submit(job.render, directory, workers) for job in pending]
+        for future in concurrent.futures.as_completed(futures):
+            print(f"rendered {future.result()}")
+    return pending
+
 if __name__ == '__main__':
-    dv0 = DataVisualizer((-2, 2), (-2, 2), 500, 500)
-    plot0 = dv0.visualize_convolution(ConvolutionFunctions.rectangle,
-                                      ConvolutionFunctions.right_triangle,
-                                      frame_spacing=5)
-    plot0.add_title("Convolution of rectangle and right triangle functions")
-    plot0.add_legend([("rectangle", (255,0,0)), ("right triangle", (0,0,255)), ("convolution", (0,255,0))])
-    plot0.save('rectangle_and_right_triangle')
-
-    dv1 = DataVisualizer((-2, 2), (-2, 2), 500, 500)
-    plot1 = dv1.visualize_convolution(ConvolutionFunctions.rectangle,
-                                      ConvolutionFunctions.isoceles_triangle,
-                                      frame_spacing=5)
-    plot1.add_title("Convolution of rectangle and isoceles triangle functions")
-    plot1.add_legend([("rectangle", (255,0,0)), ("isoceles triangle", (0,0,255)), ("convolution", (0,255,0))])
-    plot1.save('rectangle_and_isoceles_triangle')
-
-    dv2 = DataVisualizer((-1.5, 2.5), (-2, 2), 500, 1000)
-    plot2 = dv2.visualize_convolution(ConvolutionFunctions.rectangle,
-                                      ConvolutionFunctions.exponential,
-                                      frame_spacing=5)
-    plot2.add_title("Convolution of rectangle and truncated exponential functions")
-    plot2.add_legend([("rectangle", (255,0,0)), ("exponential", (0,0,255)), ("convolution", (0,255,0))])
-    plot2.save('rectangle_and_exponential')
-
-    dv3 = DataVisualizer((-2, 2), (-2, 2), 500, 500)
-    plot3 = dv3.visualize_convolution(ConvolutionFunctions.right_triangle,
-                                      ConvolutionFunctions.isoceles_triangle,
-                                      frame_spacing=5)
-    plot3.add_title("Convolution of right triangle and isoceles triangle functions")
-    plot3.add_legend([("right triangle", (255,0,0)), ("isoceles triangle", (0,0,255)), ("convolution", (0,255,0))])
-    plot3.save('right_and_isoceles_triangles')
-
-    dv4 = DataVisualizer((-1.5, 2.5), (-2, 2), 500, 500)
-    plot4 = dv4.visualize_convolution(ConvolutionFunctions.right_triangle,
-                                      ConvolutionFunctions.exponential,
-                                      frame_spacing=5)
-    plot4.add_title("Convolution of right triangle and truncated exponential functions")
-    plot4.add_legend([("exponential", (0,0,255)), ("right triangle", (255,0,0)), ("convolution", (0,255,0))])
-    plot4.save('right_triangle_and_exponential')
-
-    dv5 = DataVisualizer((-1.5, 2.5), (-2, 2), 500, 500)
-    plot5 = dv5.visualize_convolution(ConvolutionFunctions.isoceles_triangle,
-                                      ConvolutionFunctions.exponential,
-                                      frame_spacing=5)
-    plot5.add_title("Convolution of isoceles triangle and truncated exponential functions")
-    plot5.add_legend([("isoceles triangle", (255,0,0)), ("exponential", (0, 0, 255)), ("convolution", (0,255,0))])
-    plot5.save('isoceles_triangle_and_exponential')
+    parser = argparse.ArgumentParser(description="Generate the animations of convolutions listed in a manifest, "
+                                                 "skipping those whose files are up to date.")
+    parser.add_argument("--manifest", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "manifest.json"),
+                        help="JSON file listing the animations to render (default: manifest.json next to this script)")
+    parser.add_argument("--output-dir", default=".",
+                        help="directory the animations are written to (default: the current directory)")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="number of animations rendered at once (default: all cores)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="render the frames of each animation across this many processes")
+    parser.add_argument("--format", choices=Animation.formats, default=None,
+                        help="file format of all of the animations, instead of the format of each job")
+    parser.add_argument("--only", action="append",
+                        help="render only the jobs with this output name")
+    parser.add_argument("--force", action="store_true",
+                        help="render the animations even if their files are up to date")
+    args = parser.parse_args()
+
+    jobs = load_manifest(args.manifest)
+    if args.only:
+        jobs = [job for job in jobs if job.output in args.only]
+    if args.format is not None:
+        jobs = [job._replace(format=args.format) for job in jobs]
+    render_manifest(jobs, args.output_dir, concurrent_jobs=args.jobs, workers=args.workers, force=args.force)